@@ -0,0 +1,54 @@
+"""
+行动的紧凑表示：一个 int，只记录格子，不引用单位对象
+- 位布局（格子均为扁平下标 y * width + x）：
+    - 第 0 位：ACTION_MOVE / ACTION_ATTACK
+    - 第 1 位：行动者是建筑；第 2 位：攻击目标是建筑（同一格可以同时有单位和建筑）
+    - 第 3 ~ 18 位：行动者所在格
+    - 第 19 ~ 34 位：移动到的格（攻击时为出发格，原地攻击时等于行动者所在格）
+    - 第 35 ~ 50 位：攻击目标所在格（移动时为 0）
+- 同一局面下在任何进程中含义相同，可以直接 pickle 或比较；0 不是合法行动，可表示“无”
+- SearchState 直接生成和执行这种行动；execute_action 用它操作 GameManager；action_to_dict 用于界面和调试输出
+"""
+ACTION_MOVE = 0
+ACTION_ATTACK = 1
+
+KIND_MASK = 1
+ACTOR_BUILD = 2
+TARGET_BUILD = 4
+
+TILE_BITS = 16
+TILE_MASK = (1 << TILE_BITS) - 1
+UNIT_SHIFT = 3
+TO_SHIFT = UNIT_SHIFT + TILE_BITS
+TARGET_SHIFT = TO_SHIFT + TILE_BITS
+
+
+def pack_action(kind, unit_tile, to_tile, target_tile=0, actor_build=False, target_build=False):
+    return kind | actor_build * ACTOR_BUILD | target_build * TARGET_BUILD | \
+        unit_tile << UNIT_SHIFT | to_tile << TO_SHIFT | target_tile << TARGET_SHIFT
+
+
+def unpack_action(action):
+    """返回 (类型, 行动者所在格, 移动到的格, 目标格, 行动者是建筑, 目标是建筑)"""
+    return (action & KIND_MASK, action >> UNIT_SHIFT & TILE_MASK, action >> TO_SHIFT & TILE_MASK,
+            action >> TARGET_SHIFT & TILE_MASK, bool(action & ACTOR_BUILD), bool(action & TARGET_BUILD))
+
+
+def action_to_tile(action):
+    return action >> TO_SHIFT & TILE_MASK
+
+
+def action_target_tile(action):
+    return action >> TARGET_SHIFT & TILE_MASK
+
+
+def action_to_dict(action, width):
+    """转换为坐标形式的 dict，用于界面显示和调试输出"""
+    kind, unit_tile, to_tile, target_tile, _, _ = unpack_action(action)
+    result = {'unit_position': (unit_tile % width, unit_tile // width)}
+    if kind == ACTION_MOVE:
+        result.update(type='move', position=(to_tile % width, to_tile // width))
+    else:
+        result.update(type='attack', from_position=(to_tile % width, to_tile // width),
+                      target_position=(target_tile % width, target_tile // width))
+    return result
@@ -1,15 +1,15 @@
 from game import GameManager
 # from const import *
 from units import *
-import copy
-import random
-import math
-import os
-import pickle
-import subprocess
-import tempfile
-import pygame
-from ai_worker import get_all_possible_actions, execute_action, minimax, Counter
+import time
+import queue
+import threading
+from ai_worker import execute_action, search_task, WorkerPool
+from const import Counter
+from search import SearchState, DEAD
+from actions import ACTION_ATTACK, KIND_MASK, action_to_dict
+from transposition import TranspositionTable
+from planner import plan_task, BEAM_WIDTH
 
 """TODOs
 
@@ -17,137 +17,468 @@ from ai_worker import get_all_possible_actions, execute_action, minimax, Counter
 
 WORKER_THRESHOLD = 100  # 并行搜索的阈值，如果根行动数小于这个值，使用单线程版本（30）
 WORKER_SPLIT = 50  # 每个工作进程处理的行动数量阈值，用于动态计算最优工作进程数（15）
+UNIT_TIME = 1500  # 每个单位的搜索时间上限（毫秒）
+TURN_TIME = 15000  # 每回合所有单位的搜索时间上限（毫秒），平均分给还没搜索的单位
+MAX_SEARCH_DEPTH = 8  # 迭代加深的最大深度，一般先用完时间
+ACTION_DELAY = 300  # 两个单位的行动之间至少间隔的时间（毫秒），便于观看
+PONDER_INTERVAL = 500  # 对手回合中检查局面是否变化（并重新预先搜索）的间隔（毫秒）
+PLAN_TIME = 1000  # 回合开始时整回合规划的时间上限（毫秒），计入 turn_time；0 表示不规划
+PLAN_SPLIT = 8  # 整回合规划时每个工作进程至少分到的第一步候选攻击数，不够两组时不用工作进程
+INDEPENDENCE_MARGIN = 2  # 判断单位互相独立时，影响范围向外多留的格数（对手的应对）
 
 class GameAI:
-    def __init__(self, gm, render_func, search_depth=2):
+    def __init__(self, gm, render_func, unit_time=UNIT_TIME, turn_time=TURN_TIME, pool=None, max_depth=MAX_SEARCH_DEPTH,
+                 plan_time=PLAN_TIME):
         self.gm: GameManager = gm
         self.player_id = gm.ai_id
         self.render_func = render_func
         self.enemy_id = 1 - self.player_id  # 假设只有两个玩家
-        self.search_depth = search_depth  # 对抗搜索的深度
-        self.max_workers = min(10, os.cpu_count() or 1)  # 最大并行工作进程数
+        # 搜索深度由时间决定：迭代加深到时间用完（或到 max_depth）为止
+        self.unit_time = unit_time
+        self.turn_time = turn_time
+        self.max_depth = max_depth
+        self.turn_search_time = 0  # 本回合已用的搜索时间（毫秒）
+        # 整回合规划（见 planner.py）：决定攻击的组合和顺序，其余单位仍逐个搜索
+        self.plan_time = plan_time
+        self.beam_width = BEAM_WIDTH
+        # 常驻工作进程池，一般由 main 在菜单阶段创建并在多局之间共享
+        self.pool: WorkerPool = pool or WorkerPool()
+        self.max_workers = self.pool.size  # 最大并行工作进程数
+        # 单进程搜索用的置换表，跨单位、跨回合和预判保留（工作进程各有一张）；哈希精确，保留的结果不会过期
+        self.table = TranspositionTable()
+        # 后台搜索线程（见 start_turn），在第一次开始回合时创建
+        self.action_delay = ACTION_DELAY
+        self.requests = queue.Queue()  # ('search' / 'plan' / 'ponder', 请求编号, SearchState, ...)，None 表示退出
+        self.results = queue.Queue()   # (请求编号, 行动或计划, 用时)
+        self.thread = None
+        self.request_id = 0
+        self.running = False  # AI 回合是否正在进行
+        self.pending = None
+        # 对手回合中的预先搜索（见 ponder）
+        self.ponder_id = None     # 正在进行的预先搜索的请求编号，None 表示没有（或应当停止）
+        self.ponder_hash = None   # 最近一次预先搜索的预测局面
+        self.ponder_cache = {}    # (局面哈希, 单位所在格) -> 行动，只记录搜索得到的行动
+        self.ponder_plan = None   # (预测局面的哈希, 整回合计划)
+        self.next_ponder_time = 0
+        self.turn_counter = Counter()  # 本回合直接使用计划 / 预先搜索结果的次数
 
     def play_turn(self):
-        """AI执行一回合的行动"""
+        """AI执行一回合的行动（阻塞，直到回合结束；用于没有界面主循环的场合）"""
+        self.start_turn()
+        while not self.update():
+            self.render_func(True)
+            time.sleep(0.005)
+        self.render_func(True)
+
+    # region Background Turn
+    """
+    界面主循环中的 AI 回合：搜索在后台线程进行，主线程每帧调用 update() 执行已决定的行动
+    - 只有主线程读写 GameManager：主线程为每个单位生成 SearchState 放入请求队列，后台线程只在它上面搜索，
+      把 (单位序号, 行动, 用时) 放入结果队列
+    - 下一个单位的局面依赖上一个行动的结果（攻击的运气），所以一次只搜索一个单位
+    - 请求带有递增的编号，只接受编号等于 pending 的结果
+    - 已经决定的行动放在 decided 中按单位的顺序执行，相邻两次至少间隔 ACTION_DELAY；
+      轮到的单位需要搜索时，后面与它（和彼此）影响范围不重叠的单位一起交给工作进程同时搜索，
+      这些单位执行前检查行动在实际局面中仍然合法，否则从该单位开始重新逐个搜索
+    - cancel() 放弃本回合余下的单位；正在进行的搜索最多再持续一个单位的时间限制，结果被丢弃
+    - 回合开始时先做整回合规划：计划中的单位排到最前面，按计划的顺序行动，计划的攻击仍然合法时直接执行，
+      否则（运气与期望不同）和其余单位一样搜索
+    - 对手回合中 ponder() 让后台线程预先搜索预测的局面，AI 回合中局面的哈希与预测相同的单位直接使用预先搜索的结果
+    """
+
+    def _units_to_process(self):
         player = self.gm.players[self.player_id]
-                
         # 排序单位列表，优先执行更强的单位
         units_to_process = player.units + [build for build in player.builds if build.attack]
         units_to_process.sort(key=lambda unit: (-unit.attack, -unit.movement)) 
-        units_to_process += [unit for unit in player.units if hasattr(unit, 'blitz')]  # blitz 单位多考虑一次 --- [SPECIAL]
+        return units_to_process
 
-        # 为每个单位计算最佳行动并执行
-        self.render_func(True)
-        skip_units = []
-        for unit in units_to_process:
-            start_time = pygame.time.get_ticks()
-            if unit.moved and unit.attacked:
-                continue  # 跳过已经行动过的单位
-            if unit in skip_units:
-                continue
-            best_action = self._search_best_action(unit)
-            if best_action:
-                execute_action(unit, best_action, self.gm, False)
-            if hasattr(unit, 'blitz') and not unit.attacked:  # blitz 单位如果没有攻击就不会有下一轮 --- [SPECIAL]
-                skip_units.append(unit)
-                continue
-            self._move_view(unit)  # 移动视角
-            end_time = pygame.time.get_ticks()
-            pygame.time.delay(300 - end_time + start_time)  # 短暂延迟
-            self.render_func(True)  # 渲染更新
+    def start_turn(self):
+        """开始 AI 回合（主线程调用），之后每帧调用 update()"""
+        units = self._units_to_process()
+        self.units_to_process = units + [unit for unit in units if unit.blitz]  # blitz 单位多考虑一次 --- [SPECIAL]
+        self.planned_actions = [None] * len(self.units_to_process)  # 与 units_to_process 对应的计划行动
+        self.ponder_id = None  # 停止预先搜索（正在搜索的单位完成后）
+        self.unit_index = 0
+        self.skip_units = []
+        self.pending = None  # 正在等待结果的请求编号
+        self.planning = False
+        self.decided = []  # 已决定、等待执行的 (单位序号, 行动, 执行前是否要检查)
+        self.next_step_time = 0
+        self.turn_search_time = 0
+        self.running = True
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._search_loop, daemon=True)
+            self.thread.start()
+        if self.plan_time > 0 and units:
+            state = SearchState.from_game(self.gm)
+            if self.ponder_plan is not None and self.ponder_plan[0] == state.hash:
+                # 局面与预测相同，直接使用预先做好的计划
+                self.turn_counter.increment('pondered plan')
+                self._use_plan(self.ponder_plan[1])
+                return
+            self.request_id += 1
+            self.pending = self.request_id
+            self.planning = True
+            self.requests.put(('plan', self.request_id, state, [state.index_of(unit) for unit in units],
+                               min(self.plan_time, self.turn_time)))
+
+    def update(self):
+        """
+        推进 AI 回合（主线程每帧调用）：取回搜索结果并执行，到时间后提交下一个单位
+        返回 True 表示本回合已结束（已购买单位并切换到下一个玩家）
+        """
+        if not self.running:
+            return False
+        if self.pending is not None:
+            try:
+                request_id, best_action, search_time = self.results.get_nowait()
+            except queue.Empty:
+                return False
+            if request_id != self.pending:
+                return False  # 被取消的回合留下的结果
+            self.pending = None
+            self.turn_search_time += search_time
+            if self.planning:
+                self.planning = False
+                self._use_plan(best_action)
+                return False
+            self.decided.extend(best_action)
+        now = time.perf_counter()
+        if self.decided:
+            if now < self.next_step_time:
+                return False  # 短暂停留
+            self._commit(*self.decided.pop(0))
+            if self.decided:
+                return False
+        # 下一个单位的搜索和上一个行动的停留同时进行
+        if self.pending is not None or self._request_next() or now < self.next_step_time:
+            return False
 
         print('-------AI End------')
-        # 购买新单位
+        self.gm.reach_cache.counter.print('移动范围缓存')
+        self.turn_counter.print('计划 / 预先搜索')
+        self.turn_counter.reset()
+        self._clear_ponder()
+        # 购买新单位，然后结束回合
         self._try_purchase_units()
-        self.render_func(True)
-        pygame.time.delay(300)
-        # 3. 结束回合
+        self.running = False
         self.gm.next_turn()
-    
-    def _search_best_action(self, unit):
+        return True
+
+    def cancel(self):
+        """放弃本回合余下的行动并结束回合（主线程调用）；已执行的行动保留"""
+        if not self.running:
+            return
+        self.running = False
+        self.pending = None
+        self.decided = []
+        self._clear_ponder()
+        self.gm.next_turn()
+
+    def stop(self, timeout=None):
+        """结束后台线程（退出游戏或更换 GameAI 时调用），timeout 秒内没结束的搜索直接丢下"""
+        self.running = False
+        self.pending = None
+        if self.thread is not None:
+            self.requests.put(None)
+            self.thread.join(timeout)
+            self.thread = None
+
+    def _commit(self, index, action, check):
+        """执行第 index 个单位已决定的行动"""
+        unit = self.units_to_process[index]
+        if check and action:
+            state = SearchState.from_game(self.gm)
+            if not self._is_alive(unit) or action not in state.actions(state.index_of(unit)):
+                # 前面的行动影响了这个单位（独立性的判断是近似的）：从它开始重新逐个搜索
+                self.turn_counter.increment('batch invalid')
+                self.decided = []
+                self.unit_index = index
+                return
+        if action:
+            execute_action(action, self.gm)
+        if unit.blitz and not unit.attacked:  # blitz 单位如果没有攻击就不会有下一轮 --- [SPECIAL]
+            self.skip_units.append(unit)
+        else:
+            self._move_view(unit)  # 移动视角
+            self.next_step_time = time.perf_counter() + self.action_delay / 1000
+
+    def _request_next(self):
         """
-        并行版本的最佳行动搜索，使用多个进程同时计算
+        为下一个需要行动的单位决定行动（计划 / 预先搜索的结果直接放入 decided），或生成局面交给后台线程搜索；
+        没有单位时返回 False
+        """
+        while self.unit_index < len(self.units_to_process):
+            index = self.unit_index
+            self.unit_index += 1
+            unit = self.units_to_process[index]
+            if not self._needs_action(unit):
+                continue
+            # 搜索在 SearchState 上进行，不复制 GameManager
+            state = SearchState.from_game(self.gm)
+            root = state.index_of(unit)
+            planned = self.planned_actions[index]
+            if planned:
+                if planned in state.actions(root):
+                    self.turn_counter.increment('planned')
+                    self.decided.append((index, planned, False))
+                    return True
+                self.turn_counter.increment('plan invalid')
+            pondered = self.ponder_cache.get((state.hash, state.tile[root]))
+            if pondered is not None:
+                # 局面与预测相同，直接使用预先搜索的结果
+                self.turn_counter.increment('hit')
+                self.decided.append((index, pondered, False))
+                return True
+            self.turn_counter.increment('miss')
+            batch = [(index, root)]
+            if len(state.actions(root)) < WORKER_THRESHOLD:
+                batch += self._independent_units(state, index)  # 行动多的单位自己就会用上所有工作进程
+            self.unit_index = batch[-1][0] + 1
+            self.request_id += 1
+            self.pending = self.request_id
+            self.requests.put(('search', self.request_id, state, batch,
+                               self._time_limit(len(self.units_to_process) - index)))
+            return True
+        return False
+
+    def _needs_action(self, unit):
+        if unit.moved and unit.attacked:
+            return False  # 跳过已经行动过的单位
+        if not self._is_alive(unit):
+            return False  # 已经阵亡（如 blitz 单位第一次攻击时被反击消灭），index_of 找不到它
+        return unit not in self.skip_units
+
+    def _is_alive(self, unit):
+        """单位 / 建筑仍在 AI 玩家的列表中"""
+        player = self.gm.players[self.player_id]
+        return unit in (player.builds if isinstance(unit, Build) else player.units)
+
+    def _independent_units(self, state, index):
+        """
+        第 index 个单位之后，与它以及彼此都互相独立的单位 [(序号, 在 state 中的编号), ...]
+        - 按顺序连续地取，遇到不独立的、有计划行动的或 blitz 单位就停止，保证执行的顺序与逐个搜索时相同
+        - 最多取到工作进程数
+        """
+        boxes = [self._reach_box(self.units_to_process[index])]
+        batch = []
+        for follower in range(index + 1, len(self.units_to_process)):
+            if len(batch) + 1 >= self.max_workers:
+                break
+            unit = self.units_to_process[follower]
+            if not self._needs_action(unit):
+                continue
+            if unit.blitz or self.planned_actions[follower]:
+                break
+            box = self._reach_box(unit)
+            if any(box[0] <= other[2] and other[0] <= box[2] and box[1] <= other[3] and other[1] <= box[3]
+                   for other in boxes):
+                break
+            boxes.append(box)
+            batch.append((follower, state.index_of(unit)))
+        return batch
+
+    def _reach_box(self, unit):
+        """
+        单位本回合能影响的范围（移动加最大射程）的外接矩形 (x0, y0, x1, y1)，再向外多留 INDEPENDENCE_MARGIN 格
+        - 移动的格数按地图上最便宜的地形算（道路上可以超过移动力），与移动范围缓存的半径一致
+        """
+        steps = self.gm.map.max_steps(unit.move_type, unit.movement) if unit.movement else 0
+        reach = steps + unit.attack_range[1] + INDEPENDENCE_MARGIN
+        return unit.x - reach, unit.y - reach, unit.x + reach, unit.y + reach
+
+    def _use_plan(self, plan):
+        """plan: [(单位在 units_to_process 中的序号, 行动), ...]；计划中的单位按计划的顺序排到最前面"""
+        if not plan:
+            return
+        planned = dict(plan)
+        order = self._plan_order(plan, len(self.units_to_process))
+        self.units_to_process = [self.units_to_process[index] for index in order]
+        self.planned_actions = [planned.get(index) for index in order]
+        print(f'整回合规划：{len(plan)} 个单位按计划攻击')
+
+    @staticmethod
+    def _plan_order(plan, count):
+        """计划中的单位按计划的顺序在前，其余单位保持原来的顺序"""
+        planned = dict(plan)
+        return [index for index, _ in plan] + [index for index in range(count) if index not in planned]
+
+    def _clear_ponder(self):
+        self.ponder_cache.clear()
+        self.ponder_plan = None
+        self.ponder_hash = None
+
+    def ponder(self):
+        """
+        对手回合中由主线程每帧调用：局面变化时，让后台线程预先搜索预测的 AI 回合
+        - 预测：对手不再行动直接结束回合；各单位按 AI 回合的顺序，依次执行预先搜索得到的行动（攻击按期望运气）
+        - 结果按 (局面哈希, 单位所在格) 记录；预先搜索也填充了置换表（工作进程的置换表同样被填充），
+          局面不同但相近时，正式搜索中重复的子树仍然可以直接命中
+        - 局面又变化或 AI 回合开始时，放弃余下的单位（正在搜索的单位完成后）
+        """
+        now = time.perf_counter()
+        if now < self.next_ponder_time:
+            return
+        self.next_ponder_time = now + PONDER_INTERVAL / 1000
+        state = SearchState.from_game(self.gm)
+        roots = [state.index_of(unit) for unit in self._units_to_process()]
+        state.next_turn()
+        if state.cur_player_id != self.player_id or state.hash == self.ponder_hash:
+            return
+        self.ponder_hash = state.hash
+        self.request_id += 1
+        self.ponder_id = self.request_id
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._search_loop, daemon=True)
+            self.thread.start()
+        self.requests.put(('ponder', self.request_id, state, roots))
+
+    def _search_loop(self):
+        """后台线程：逐个处理请求队列中的局面，None 表示退出"""
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            if request[0] == 'ponder':
+                if request[1] == self.ponder_id:  # 排队期间局面又变化或 AI 回合已经开始的请求直接丢弃
+                    self._ponder(*request[1:])
+                continue
+            if request[0] == 'plan':
+                _, request_id, state, roots, time_limit = request
+                plan_start = time.perf_counter()
+                try:
+                    plan = self._plan_turn(state, roots, time_limit)
+                except Exception as e:
+                    print(f"AI plan error: {e}")
+                    plan = []
+                self.results.put((request_id, plan, (time.perf_counter() - plan_start) * 1000))
+                continue
+            _, request_id, state, batch, time_limit = request
+            search_start = time.perf_counter()
+            try:
+                if len(batch) == 1:
+                    index, root = batch[0]
+                    decided = [(index, self._search_best_action(state, root, time_limit), False)]
+                else:
+                    decided = self._search_batch(state, batch, time_limit)
+            except Exception as e:
+                print(f"AI search error: {e}")
+                decided = [(index, None, False) for index, _ in batch]
+            self.results.put((request_id, decided, (time.perf_counter() - search_start) * 1000))
+
+    def _search_batch(self, state, batch, time_limit):
+        """
+        后台线程：互相独立的几个单位在同一局面上同时搜索，每个单位一个工作进程
+        返回按 batch 顺序的 [(单位序号, 行动, 执行前是否要检查)]，除第一个外都要检查
+        """
+        pool_state, roots = state.compact([root for _, root in batch])
+        tasks = [(root, self.player_id, self.enemy_id, self.max_depth, pool_state.actions(root), time_limit)
+                 for root in roots]
+        results = self.pool.run('search', pool_state, tasks)
+        print(f'同时搜索 {len(batch)} 个互相独立的单位')
+        return [(index, result[-1][0] if result else None, position > 0)
+                for position, ((index, _), result) in enumerate(zip(batch, results))]
+
+    def _plan_turn(self, state, roots, time_limit):
+        """
+        后台线程：整回合规划，返回 [(单位在 roots 中的序号, 行动), ...]
+        - 第一步的候选攻击足够多时分组交给工作进程，取分数最高的计划（同分取靠前的组）；不如不攻击时返回 []
+        """
+        attacks = [action for root in roots for action in state.actions(root) if action & KIND_MASK == ACTION_ATTACK]
+        if not attacks:
+            return []
+        num_workers = min(self.max_workers, len(attacks) // PLAN_SPLIT)
+        if num_workers >= 2:
+            groups = self._split_actions(attacks, num_workers)
+            results = self.pool.plan(state, roots, self.player_id, self.enemy_id, self.beam_width, groups, time_limit)
+            score, plan = state.evaluate(self.player_id, self.enemy_id), []
+            for result in results:
+                if result and result[0] > score:
+                    score, plan = result
+        else:
+            score, plan = plan_task(state, roots, self.player_id, self.enemy_id, self.beam_width, time_limit)
+        return [(roots.index(state.actor_of(action)), action) for action in plan]
+
+    def _ponder(self, request_id, state, roots):
+        """
+        后台线程：先对预测局面做整回合规划，再按 AI 回合的顺序预先搜索计划之外的单位，
+        每个单位的行动都在局面上执行，得到下一个单位的预测局面
+        """
+        plan = []
+        if self.ponder_id != request_id:
+            return
+        if self.plan_time > 0:
+            try:
+                plan = self._plan_turn(state, roots, self.plan_time)
+            except Exception as e:
+                print(f"AI ponder error: {e}")
+                return
+            if self.ponder_id != request_id:
+                return
+            self.ponder_plan = (state.hash, plan)
+        planned = dict(plan)
+        for index in self._plan_order(plan, len(roots)):
+            root = roots[index]
+            if self.ponder_id != request_id:
+                return  # 局面已经变化，或 AI 回合已经开始
+            if state.flags[root] & DEAD:
+                continue
+            key = (state.hash, state.tile[root])
+            best_action = planned.get(index) or self.ponder_cache.get(key)
+            if best_action is None:
+                try:
+                    best_action = self._search_best_action(state, root, self.unit_time)
+                except Exception as e:
+                    print(f"AI ponder error: {e}")
+                    return
+                if best_action is None:
+                    continue  # 没有行动或搜索失败时不记录，正式回合中重新搜索
+                self.ponder_cache[key] = best_action
+                self.turn_counter.increment('pondered')
+            state.execute(best_action)
+            state.settle(root)
+
+    # endregion Background Turn
+
+    def _time_limit(self, units_left):
+        """当前单位的搜索时间（毫秒）：单位上限，和本回合剩余时间的平均分配，取较小者"""
+        remaining = max(0, self.turn_time - self.turn_search_time)
+        return min(self.unit_time, remaining / units_left)
+
+    def _search_best_action(self, state, root, time_limit=UNIT_TIME):
+        """
+        并行版本的最佳行动搜索，使用多个进程同时计算，迭代加深到 time_limit（毫秒）用完为止
+        - state 的所有权交给本函数（搜索会临时修改它），root 是要行动的单位在 state 中的编号
+        - 在后台线程中运行，不访问 GameManager
+        返回 execute_action 使用的行动（actions.py 的 int 表示），或 None
         """
-        
         # 获取所有可能的行动
-        root_actions = get_all_possible_actions(unit, self.gm)
+        root_actions = state.actions(root)
         if not root_actions:
             return None
         
         # 如果行动数量少于阈值，使用非并行版本
         if len(root_actions) < WORKER_THRESHOLD:
             print('single\n')
-            return self._search_best_action_non_parallel(unit, root_actions)
-        
-        # 创建临时目录存放进程间通信文件
-        _dir = os.path.join(tempfile.gettempdir(), "tinywar")
-        os.makedirs(_dir, exist_ok=True)
-        temp_dir = tempfile.mkdtemp(dir=_dir)
-        
-        # 准备游戏状态数据
-        game_state_data = pickle.dumps(copy.deepcopy(self.gm))
-        unit_data = pickle.dumps(unit)
-        
-        # 将行动分组，每组由一个工作进程处理
-        action_groups = self._split_actions(root_actions)
-
-        processes = []
-        input_files = []
-        output_files = []
-        
-        # 启动工作进程
-        for i, action_group in enumerate(action_groups):
-            input_file = os.path.join(temp_dir, f"input_{i}.pkl")
-            output_file = os.path.join(temp_dir, f"output_{i}.pkl")
-            
-            # 准备输入数据
-            input_data = {
-                'game_state': game_state_data,
-                'unit': unit_data,
-                'player_id': self.player_id,
-                'enemy_id': self.enemy_id,
-                'search_depth': self.search_depth,
-                'actions': action_group
-            }
-            
-            # 写入输入文件
-            with open(input_file, 'wb') as f:
-                pickle.dump(input_data, f)
-            
-            # 启动工作进程
-            cmd = f"python {os.path.join(os.path.dirname(__file__), 'ai_worker.py')} {input_file} {output_file}"
-            process = subprocess.Popen(cmd, shell=True)
-            
-            processes.append(process)
-            input_files.append(input_file)
-            output_files.append(output_file)
-        
-        # 等待所有进程完成
-        for process in processes:
-            process.wait()
-        
-        # 收集结果
-        best_action = None
-        best_score = float('-inf')
-        
-        for output_file in output_files:
-            try:
-                if os.path.exists(output_file) and os.path.getsize(output_file) > 0:
-                    with open(output_file, 'rb') as f:
-                        action = pickle.loads(f.read())
-                        if action and action.get('score', float('-inf')) > best_score:
-                            best_score = action['score']
-                            best_action = action
-            except Exception as e:
-                print(f"Error reading result: {e}")
-        
-        # 清理临时文件
-        for file in input_files + output_files:
-            if os.path.exists(file):
-                os.remove(file)
-        os.rmdir(temp_dir)
-        
-        return best_action
+            best = self._search_best_action_non_parallel(state, root, root_actions, time_limit)
+        else:
+            # 将行动分组，每组由一个工作进程处理
+            action_groups = self._split_actions(root_actions)
+            results = self.pool.search(state, root, self.player_id, self.enemy_id,
+                                       self.max_depth, action_groups, time_limit)
+            # 各组完成的深度可能不同，只比较所有组都完成了的最深一层
+            results = [result for result in results if result]
+            best = None
+            if results:
+                depth = min(len(result) for result in results)
+                for result in results:
+                    if best is None or result[depth - 1][1] > best[1]:
+                        best = result[depth - 1]
+        if not best:
+            return None
+        print(f'最佳行动：{action_to_dict(best[0], state.width)}，分数 {best[1]}')
+        return best[0]
     
     def _split_actions(self, actions, num_workers=None):
         """
@@ -171,24 +502,18 @@ class GameAI:
             result[i % num_workers].append(action)
         return result
 
-    def _search_best_action_non_parallel(self, unit, root_actions):
+    def _search_best_action_non_parallel(self, state, root, root_actions, time_limit=UNIT_TIME):
         """
-        为指定 unit 计算最佳行动，使用 Alpha-Beta 剪枝优化的 minimax 递归。
-        返回格式：{'unit': unit, 'action': action, 'score': score} 或 None（如果无可行动）。
+        为指定单位计算最佳行动，使用 Alpha-Beta 剪枝优化的 minimax 迭代加深。
+        返回最深的完成层的 (行动, 分数) 或 None（如果无可行动）。
         """
         if not root_actions:
             return None
-            
-        # 从根节点开始调用 minimax，初始 alpha=-inf, beta=inf
-        root_state = copy.deepcopy(self.gm)
-        # counter = Counter()
-        best, score = minimax(root_state, unit, 0, True, float('-inf'), float('inf'), 
-                             self.search_depth, self.player_id, self.enemy_id, None)
-        # counter.print()
-        if not best:
+        results = search_task(state, root, self.player_id, self.enemy_id, self.max_depth,
+                              root_actions, time_limit, self.table)
+        if not results:
             return None
-        best['score'] = score
-        return best
+        return results[-1]
     
     def _try_purchase_units(self):
         """尝试在可用的建筑中购买单位"""
@@ -203,7 +528,7 @@ class GameAI:
             
             # 按性价比排序
             available_units.sort(key=lambda unit_type: 
-                                Unit.PROPERTIES[unit_type]['attack'] / Unit.PROPERTIES[unit_type]['price'])
+                                TypeTable.attack[TypeTable.ids[unit_type]] / TypeTable.price[TypeTable.ids[unit_type]])
             
             # 尝试购买最好的单位
             for unit_type in available_units:
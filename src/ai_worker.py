@@ -1,9 +1,28 @@
 import os
 os.environ['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
-from units import Unit
+from units import Build, TypeTable
 import sys
 import pickle
-import copy
+import struct
+import subprocess
+import time
+import threading
+from multiprocessing import shared_memory
+from snapshot import encode_state, read_header, MOVED, ATTACKED
+from search import SearchState
+from actions import ACTION_MOVE, ACTION_ATTACK, KIND_MASK, pack_action, unpack_action, action_to_tile, \
+    action_target_tile
+from transposition import TranspositionTable
+from planner import plan_task
+
+ACTION_NAMES = {ACTION_MOVE: 'move', ACTION_ATTACK: 'attack'}
+NULL_WINDOW = 1e-6  # PVS 零窗口的宽度，分数差小于它视为相同
+ASPIRATION_WINDOW = 50  # 迭代加深时根节点的期望窗口（上一层分数 ± 该值），约为一个建筑的分值
+
+
+class SearchTimeout(Exception):
+    """minimax 超过截止时间，由迭代加深在外层捕获"""
+
 
 class Counter:
     """用于统计和打印调试信息的计数器类"""
@@ -24,113 +43,173 @@ class Counter:
         print("==================\n")
 counter = Counter()
 
-def minimax(game_state, root_unit, current_depth, is_maximizing, alpha, beta, search_depth, player_id, enemy_id, root_actions, counter=None):
+class MoveOrdering:
+    """
+    minimax 的走法排序，每次搜索（search_task）一个实例
+    - 顺序：置换表记录的最佳行动 > 攻击（按期望收益） > 本层的杀手行动 > 其余行动（按历史分数，再按目标格防御）
+    - 杀手行动：每层最近两个引起剪枝的移动；历史分数：引起剪枝的移动累加 剩余深度²
+    - 统计剪枝次数和其中发生在第一个行动上的次数，衡量排序的效果
+    """
+    def __init__(self):
+        self.killers = {}  # 层数 -> [行动, ...]
+        self.history = {}  # 行动 -> 分数
+        self.cutoffs = 0
+        self.first_cutoffs = 0
+        self.researches = 0  # PVS 零窗口失败后的重新搜索次数
+
+    def order(self, state, actions, ply, best_action=None):
+        """把行动列表原地排序"""
+        killers = self.killers.get(ply, ())
+        history = self.history
+        defence = state.map.defence
+
+        def priority(action):
+            if action == best_action:
+                return 4, 0, 0
+            if action & KIND_MASK == ACTION_ATTACK:
+                return 3, state.attack_value(state.actor_of(action), state.target_of(action)), 0
+            if action in killers:
+                return 2, -killers.index(action), 0
+            return 1, history.get(action, 0), defence[action_to_tile(action)]
+        actions.sort(key=priority, reverse=True)
+
+    def cutoff(self, action, ply, depth, index):
+        """第 index 个行动 action 引起了剪枝，depth 为剩余深度"""
+        self.cutoffs += 1
+        if index == 0:
+            self.first_cutoffs += 1
+        if action & KIND_MASK == ACTION_ATTACK:
+            return
+        killers = self.killers.setdefault(ply, [])
+        if action not in killers:
+            killers.insert(0, action)
+            del killers[2:]
+        self.history[action] = self.history.get(action, 0) + depth * depth
+
+    def print(self):
+        rate = self.first_cutoffs / self.cutoffs if self.cutoffs else 0
+        print(f"剪枝 {self.cutoffs} 次，第一个行动剪枝 {self.first_cutoffs} 次（{rate:.0%}），零窗口重新搜索 {self.researches} 次")
+
+
+def minimax(state, root, current_depth, is_maximizing, alpha, beta, search_depth, player_id, enemy_id, root_actions, counter=None, root_tile=None, table=None, deadline=None, ordering=None):
     """
     实现minimax算法的工作函数，用于在独立进程中执行
+    - state: SearchState，行动在其上执行，递归返回后撤销
+    - root: 根单位在 state 中的编号；root_tile 是它搜索开始时的位置（递归内部传递）
+    - table: TranspositionTable，为 None 时不使用置换表
+    - deadline: time.perf_counter() 的截止时间，超过时抛出 SearchTimeout（state 中留有未撤销的行动）
+    - ordering: MoveOrdering，非根节点按它排序，并对第一个以外的行动先做零窗口搜索（PVS）；
+      为 None 时按生成顺序逐个完整搜索（用作对照）
+    - 返回 (行动, 分数)，行动为 SearchState.actions() 的元素（actions.py 的 int 表示）
     """
     # 终止条件：达到最大搜索深度或游戏结束
-    if current_depth >= search_depth or game_state.check_game_over():
-        return None, evaluate_state(game_state, player_id, enemy_id)
+    if current_depth >= search_depth or state.check_game_over():
+        return None, state.evaluate(player_id, enemy_id)
+    if deadline is not None and time.perf_counter() >= deadline:
+        raise SearchTimeout
+    if root_tile is None:
+        root_tile = state.tile[root]
     
     player_id_current = player_id if is_maximizing else enemy_id
     best_score = float('-inf') if is_maximizing else float('inf')
     best_action = None
+    width = state.width
+    root_x, root_y = root_tile % width, root_tile // width
+    root_type = state.kind[root]
 
-    # 根节点只针对传入的unit；递归节点针对当前玩家所有单位
-    units = [root_unit] if current_depth == 0 else game_state.players[player_id_current].units
-    
-    for unit_to_process in units:
-        if unit_to_process.moved and unit_to_process.attacked:
-            continue
-        # Optimization DEBUG: default 2, mod to 4
-        if current_depth==2 and abs(unit_to_process.x - root_unit.x) + abs(unit_to_process.y - root_unit.y) > 4:
-            continue
-        considered_targets=set()
-
-        possible_actions = root_actions if root_actions else get_all_possible_actions(unit_to_process, game_state)
-        for action in possible_actions:
-            
-            # Optimization
-            if current_depth==2:
-                if action['type'] == 'move' or root_unit.movement > 4:
-                    continue
-                if action['type'] == 'attack':
-                    target = action['target']
-                    target_id = (target.x, target.y)
+    # 置换表：根节点只搜索根单位（或其中一组行动），不查表
+    key = None
+    if table is not None and current_depth > 0:
+        context = (current_depth, player_id)
+        if current_depth <= 2 < search_depth:
+            context += (root_tile, root_type)  # 子树中有第 2 层，其剪枝条件依赖根单位
+        key = state.hash ^ table.context_key(context)
+        entry = table.probe(key, search_depth - current_depth, alpha, beta)
+        if entry is not None:
+            return entry
+    alpha_start, beta_start = alpha, beta
+
+    # 根节点只针对传入的unit（行动已由 search_task 排好序）；递归节点针对当前玩家所有单位
+    if current_depth == 0:
+        moves = root_actions
+    else:
+        moves = []
+        for unit_to_process in state.units_of(player_id_current):
+            if state.flags[unit_to_process] & (MOVED | ATTACKED) == MOVED | ATTACKED:
+                continue
+            # Optimization DEBUG: default 2, mod to 4
+            tile = state.tile[unit_to_process]
+            if current_depth==2 and abs(tile % width - root_x) + abs(tile // width - root_y) > 4:
+                continue
+            considered_targets=set()
+            for action in state.actions(unit_to_process):
+                # Optimization
+                if current_depth==2:
+                    if action & KIND_MASK == ACTION_MOVE or TypeTable.movement[root_type] > 4:
+                        continue
+                    target_id = action_target_tile(action)
                     if target_id in considered_targets:
                         continue
                     considered_targets.add(target_id)
-            
-            if counter: # DEBUG:
-                counter.increment(f'{current_depth}-{root_unit.type}-{action["type"]}', 1)
-
-            # 模拟执行行动
-            memo = {id(game_state.map): game_state.map}
-            next_state = copy.deepcopy(game_state, memo)
-            execute_action(unit_to_process, action, next_state, True)
-            next_state.next_turn()
-            
-            # 递归，并传递alpha, beta
-            _, score = minimax(next_state, root_unit, current_depth + 1, not is_maximizing, 
-                              alpha, beta, search_depth, player_id, enemy_id, None, counter)
-                            
+                moves.append(action)
+        if ordering is not None:
+            ordering.order(state, moves, current_depth, table.best_move(key) if key is not None else None)
+
+    for index, action in enumerate(moves):
+        if counter: # DEBUG:
+            counter.increment(f'{current_depth}-{TypeTable.names[root_type]}-{ACTION_NAMES[action & KIND_MASK]}', 1)
+
+        # 在同一个局面上执行行动，递归返回后撤销
+        mark = state.begin_undo()
+        state.execute(action)
+        state.next_turn()
+
+        # 递归，并传递alpha, beta
+        args = (state, root, current_depth + 1, not is_maximizing)
+        rest = (search_depth, player_id, enemy_id, None, counter, root_tile, table, deadline, ordering)
+        if index == 0 or ordering is None:
+            _, score = minimax(*args, alpha, beta, *rest)
+        else:
+            # PVS：先用零窗口判断能否超过当前最好的行动，能超过且不引起剪枝时再用完整窗口搜索
             if is_maximizing:
-                if score > best_score:
-                    best_score, best_action = score, action
-                alpha = max(alpha, best_score)
+                _, score = minimax(*args, alpha, alpha + NULL_WINDOW, *rest)
             else:
-                if score < best_score:
-                    best_score, best_action = score, action
-                beta = min(beta, best_score)
-            # 行为层剪枝
-            if beta <= alpha:
-                break
-        # 单位层剪枝
+                _, score = minimax(*args, beta - NULL_WINDOW, beta, *rest)
+            if alpha < score < beta:
+                ordering.researches += 1
+                _, score = minimax(*args, alpha, beta, *rest)
+        state.undo(mark)
+
+        if is_maximizing:
+            if score > best_score:
+                best_score, best_action = score, action
+            alpha = max(alpha, best_score)
+        else:
+            if score < best_score:
+                best_score, best_action = score, action
+            beta = min(beta, best_score)
+        # 剪枝
         if beta <= alpha:
+            if ordering is not None:
+                ordering.cutoff(action, current_depth, search_depth - current_depth, index)
             break
     
     # 如果没有任何可行分支，则直接评估当前状态
-    if best_action is None and best_score in (float('-inf'), float('inf')):
-        return None, evaluate_state(game_state, player_id, enemy_id)
+    if best_action is None:
+        best_score = state.evaluate(player_id, enemy_id)
+        alpha_start, beta_start = float('-inf'), float('inf')  # 精确值
+    if key is not None:
+        table.store(key, search_depth - current_depth, best_score, alpha_start, beta_start, best_action)
     
     return best_action, best_score
 
-def evaluate_state(game_state, player_id, enemy_id):
-    """评估模拟状态的分数"""    
-    my_player = game_state.players[player_id]
-    enemy_player = game_state.players[enemy_id]
-    
-    score = 0
-
-    # 1. 单位数量和健康状况
-    my_unit_value = sum(unit.health / unit.max_health * Unit.PROPERTIES[unit.type]['price'] 
-                       for unit in my_player.units)
-    enemy_unit_value = sum(unit.health / unit.max_health * Unit.PROPERTIES[unit.type]['price'] 
-                          for unit in enemy_player.units)
-    score += my_unit_value - enemy_unit_value
-    
-    # 2. 建筑控制
-    my_build_value = sum(5 for build in my_player.builds)
-    enemy_build_value = sum(5 for build in enemy_player.builds)
-    score += (my_build_value - enemy_build_value) * 10
-    
-    # 3. 经济状况
-    score += (my_player.money - enemy_player.money) * 0.5
-
-    # DEBUG:
-    # for unit in enemy_player.units:
-    #     if unit.type == 'fighter':
-    #         score -= unit.health * 10
-    
-    return score
-
 def get_all_possible_actions(unit, game_state=None):
     """
     获得单位所有可能的移动和攻击行动
     - unit：要生成行动的单位对象
     - game_state：要在其上生成行动的游戏状态，默认为 None
     返回：
-        actions: 包含所有 {'type': 'move'/'attack', ...} 的列表
+        actions: 行动列表（actions.py 的 int 表示），攻击在前，移动在后
     """
     # 选择使用的状态对象
     state = game_state
@@ -139,117 +218,313 @@ def get_all_possible_actions(unit, game_state=None):
     # 设定当前选中单位并计算可达格子，第二个参数控制是否允许跨越攻击范围 >1
     # 建筑的移动会被跳过
     state.selected_unit = unit
-    override_movement = 1 if hasattr(unit, 'blitz') and unit.attacked else None # blitz 单位override_movement --- [SPECIAL]
+    override_movement = 1 if unit.blitz and unit.attacked else None # blitz 单位override_movement --- [SPECIAL]
     state._calculate_possible_moves(unit.moved, unit.attack_range[0]>1, override_movement)
 
+    width = state.map.width
+    unit_tile = unit.y * width + unit.x
+    is_build = isinstance(unit, Build)
     # Optimzation 优先考虑攻击
     # ---- 2. 收集所有由 GM 预先计算出的攻击行动 ----
     actions = []
-    for from_pos, to_pos, target in state.possible_attacks:
-        actions.append({
-            'type': 'attack',
-            'from_position': from_pos,
-            'target_position': to_pos,
-            'target': target,
-        })
+    for (fx, fy), (tx, ty), target in state.possible_attacks:
+        actions.append(pack_action(ACTION_ATTACK, unit_tile, fy * width + fx, ty * width + tx,
+                                   is_build, isinstance(target, Build)))
     # ---- 3. 收集所有移动行动 ----
-    for move_pos in state.possible_moves:
-        actions.append({
-            'type': 'move',
-            'position': move_pos,
-        })
+    for x, y in state.possible_moves:
+        actions.append(pack_action(ACTION_MOVE, unit_tile, y * width + x, 0, is_build))
     # 这里不能加deselect，因为执行的时候还会检查 possible_moves 和 possible_attacks
     return actions
 
-def execute_action(unit, action, game_state, is_simulation):
+def execute_action(action, game_state, is_simulation=False):
     """
     在真实环境或复制环境中执行一次行动。
-    - unit: 要执行行动的单位
-    - action: 要执行的行动
+    - action: 要执行的行动（actions.py 的 int 表示），行动者按其所在格在 game_state 中查找
     - game_state: 游戏状态对象
     - is_simulation: 是否是模拟环境，默认为False
     """
-    # 选择要操作的 GameManager
     gm = game_state
-
-    player_id = gm.cur_player_id
+    kind, unit_tile, to_tile, target_tile, actor_build, _ = unpack_action(action)
+    width = gm.map.width
     # ——1) 选中单位——
-    if is_simulation:
-        # 模拟环境里需要根据坐标去复制对象列表里找对应的 unit_copy
-        player = gm.players[player_id]
-        unit_copy = next(
-            (u for u in player.units + player.builds
-            if u.x == unit.x and u.y == unit.y),
-            None
-        )
-        if not unit_copy:
-            return  # 单位没找到，无法模拟
-        gm.selected_unit = unit_copy
-    else:
-        # 真实环境中直接用传进来的 unit
-        gm.selected_unit = unit
+    x, y = unit_tile % width, unit_tile // width
+    unit = gm.build_at(x, y) if actor_build else gm.unit_at(x, y)
+    if unit is None or unit.player_id != gm.cur_player_id:
+        return  # 单位没找到，无法执行
+    # 选中并计算 possible_moves / possible_attacks，移动和攻击时会检查
+    get_all_possible_actions(unit, gm)
     # ——2) 执行动作——
-    type = action.get('type')
-    if type == 'move':
-        x, y = action['position']
-        gm.move_selected_unit(x, y, is_simulation)
-
-    elif type == 'attack':
-        # 可能要先移动
-        fx, fy = action['from_position']
-        if (fx, fy) != (unit.x, unit.y):
-            gm.move_selected_unit(fx, fy, is_simulation)
-
-        # 再执行攻击
-        tx, ty = action['target_position']
-        gm.attack(tx, ty, is_simulation)
-
-def search_task(game_state_data, unit_data, player_id, enemy_id, search_depth, actions=None):
-    """工作进程的主函数，接收序列化数据并返回最佳行动"""
-    # from game import GameManager
-    # from units import Unit
-    
-    # 反序列化游戏状态和单位
-    game_state = pickle.loads(game_state_data)
-    unit = pickle.loads(unit_data)
-    
+    if to_tile != unit_tile:
+        # 移动（攻击时先移动到出发格）
+        gm.move_selected_unit(to_tile % width, to_tile // width, is_simulation)
+    if kind == ACTION_ATTACK:
+        gm.attack(target_tile % width, target_tile // width, is_simulation)
+
+def search_task(state, root, player_id, enemy_id, max_depth, actions=None, time_limit=None, table=None):
+    """
+    工作进程的主函数：在 SearchState 上对根单位 root 做迭代加深搜索
+    - 依次完成深度 1, 2, ..., max_depth，用完 time_limit（毫秒，None 表示不限时）时放弃正在进行的那一层
+    - 深度 1 不限时，保证总有结果；根节点的行动先按 MoveOrdering 排序，之后每层把上一层的最佳行动放到最前面
+    - 从深度 2 开始，根节点先用以上一层分数为中心的期望窗口搜索，分数落在窗口外时再用完整窗口重新搜索
+    - table: 置换表，工作进程在各次任务之间保留同一张表
+    返回各个完成的深度的结果 [(行动, 分数), ...]，第 i 项对应深度 i + 1；没有可行行动时返回 []
+    """
     # 使用传入的行动列表，如果没有则重新计算
-    root_actions = actions if actions is not None else get_all_possible_actions(unit, game_state)
+    root_actions = list(actions) if actions is not None else state.actions(root)
     if not root_actions:
-        return None
+        return []
+    start = time.perf_counter()
+    deadline = None if time_limit is None else start + time_limit / 1000
     counter = Counter() # DEBUG:
-    # 执行minimax搜索
-    best_action, score = minimax(game_state, unit, 0, True, float('-inf'), float('inf'), 
-                               search_depth, player_id, enemy_id, root_actions, counter)
+    if table is not None:
+        table.new_search()
+    ordering = MoveOrdering()
+    ordering.order(state, root_actions, 0)
+    results = []
+    aspiration_failures = 0
+    mark = state.begin_undo()
+    for depth in range(1, max_depth + 1):
+        iteration_start = time.perf_counter()
+        alpha, beta = float('-inf'), float('inf')
+        if results:
+            alpha, beta = results[-1][1] - ASPIRATION_WINDOW, results[-1][1] + ASPIRATION_WINDOW
+        try:
+            best_action, score = minimax(state, root, 0, True, alpha, beta, depth, player_id, enemy_id, root_actions,
+                                         counter, None, table, deadline if depth > 1 else None, ordering)
+            if results and not alpha < score < beta:
+                aspiration_failures += 1
+                best_action, score = minimax(state, root, 0, True, float('-inf'), float('inf'), depth, player_id,
+                                             enemy_id, root_actions, counter, None, table, deadline, ordering)
+        except SearchTimeout:
+            state.undo(mark)
+            break
+        if not best_action:
+            break
+        results.append((best_action, score))
+        root_actions.remove(best_action)
+        root_actions.insert(0, best_action)
+        # 更深一层至少要花同样多的时间，剩余时间不够就不再开始
+        now = time.perf_counter()
+        if deadline is not None and now + (now - iteration_start) > deadline:
+            break
+    print(f'迭代加深：完成深度 {len(results)}，用时 {(time.perf_counter() - start) * 1000:.0f} ms，'
+          f'期望窗口失败 {aspiration_failures} 次')
+    ordering.print()
     counter.print()
-    if not best_action:
+    if table is not None:
+        table.print()
+    return results
+
+TASKS = {'search': search_task, 'plan': plan_task}  # 工作进程可以执行的任务：消息类型 -> 函数
+
+# region Worker Pool
+"""
+常驻工作进程池：每局游戏只启动一次，进程里保留已导入的模块和地图
+- 通信走进程的 stdin / stdout 管道，每条消息是 4 字节长度 + pickle 数据
+- 地图只在 set_map 时发送一次（附带 map_id）
+- 每次搜索把局面编码成二进制快照（见 snapshot.py），只写入一次共享内存，各进程只读映射后恢复成 SearchState；
+  管道里只传共享内存的名字、根单位编号和各自的行动分组
+- 工作进程崩溃时自动重启，该任务改为在主进程里计算
+- 每个工作进程有自己的置换表，在整局游戏的各次任务之间保留
+- 任务带有时间限制，工作进程到时自行放弃未完成的那一层并返回已完成的结果，不需要主进程打断
+"""
+
+def attach_shared_memory(name):
+    """以不追踪的方式映射已存在的共享内存，避免工作进程退出时被 resource_tracker 删除"""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if os.name == 'posix':
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+def send_message(stream, message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    stream.write(struct.pack('<I', len(data)))
+    stream.write(data)
+    stream.flush()
+
+def recv_message(stream):
+    """读取一条消息，管道关闭时返回 None"""
+    header = stream.read(4)
+    if len(header) < 4:
         return None
-    
-    best_action['score'] = score
-    
-    # 序列化结果
-    return pickle.dumps(best_action)
+    size, = struct.unpack('<I', header)
+    data = stream.read(size)
+    if len(data) < size:
+        return None
+    return pickle.loads(data)
+
+def serve():
+    """
+    工作进程主循环：('map', map_id, data) 更新地图，('search' 或 'plan', ...) 执行 TASKS 中的任务，
+    ('stop',) 或管道关闭时退出
+    """
+    channel_in = sys.stdin.buffer
+    channel_out = os.fdopen(os.dup(sys.stdout.fileno()), 'wb')
+    sys.stdout = sys.stderr  # 调试打印不能混进结果通道
+    game_map, map_id = None, None
+    shm = None
+    table = TranspositionTable()
+    while True:
+        message = recv_message(channel_in)
+        if message is None or message[0] == 'stop':
+            break
+        if message[0] == 'map':
+            map_id, game_map = message[1], pickle.loads(message[2])
+        elif message[0] in TASKS:
+            task_id, shm_name, args = message[1], message[2], message[3]
+            try:
+                if shm is None or shm.name != shm_name:
+                    if shm is not None:
+                        shm.close()
+                    shm = attach_shared_memory(shm_name)
+                if read_header(shm.buf)[0] != map_id:
+                    raise ValueError("Snapshot map does not match the cached map")
+                state = SearchState.from_snapshot(shm.buf, game_map)
+                result = TASKS[message[0]](state, *args, table=table)
+                send_message(channel_out, ('result', task_id, result))
+            except Exception as e:
+                send_message(channel_out, ('error', task_id, repr(e)))
+    if shm is not None:
+        shm.close()
+
+
+class WorkerPool:
+    """常驻的 AI 搜索进程池，进程在第一次使用（或调用 start）时启动"""
+    def __init__(self, size=None):
+        self.size = size or min(10, os.cpu_count() or 1)
+        self.workers = []
+        self.game_map = None
+        self.map_id = 0
+        self.map_data = None
+        self.shm = None  # 局面快照所在的共享内存，容量不够时重新创建
+        self.task_id = 0
+        self.lock = threading.Lock()  # 搜索可能来自不同线程（如更换 GameAI 时旧的后台线程还没结束），一次只进行一个
+
+    def start(self):
+        """补齐工作进程（也用于崩溃后重启）"""
+        self.workers = [worker for worker in self.workers if worker.poll() is None]
+        while len(self.workers) < self.size:
+            worker = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__)],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            if self.map_data is not None:
+                send_message(worker.stdin, ('map', self.map_id, self.map_data))
+            self.workers.append(worker)
+
+    def set_map(self, game_map):
+        """向所有工作进程发送地图，之后的快照只记录 map_id"""
+        self.game_map = game_map
+        self.map_id += 1
+        self.map_data = pickle.dumps(game_map, pickle.HIGHEST_PROTOCOL)
+        for worker in self.workers:
+            try:
+                send_message(worker.stdin, ('map', self.map_id, self.map_data))
+            except OSError:
+                pass  # 已崩溃的进程在下次 start 时替换
+
+    def _write_snapshot(self, game_state):
+        if isinstance(game_state, SearchState):
+            data = game_state.to_snapshot(self.map_id)
+        else:
+            data = encode_state(game_state, self.map_id)
+        if self.shm is None or self.shm.size < len(data):
+            self._release_snapshot()
+            self.shm = shared_memory.SharedMemory(create=True, size=max(len(data) * 2, 4096))
+        self.shm.buf[:len(data)] = data
+
+    def _release_snapshot(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def search(self, game_state, root, player_id, enemy_id, max_depth, action_groups, time_limit=None):
+        """
+        把每组行动交给一个工作进程做迭代加深搜索，按组的顺序返回各组结果（search_task 的返回值，出错时为 None）
+        - game_state: GameManager 或 SearchState；root 是根单位在 SearchState 中的编号
+        - time_limit: 每个任务的时间限制（毫秒）
+        """
+        if isinstance(game_state, SearchState):
+            game_state, (root,) = game_state.compact([root])  # 编号以工作进程恢复出的局面为准
+        tasks = [(root, player_id, enemy_id, max_depth, group, time_limit) for group in action_groups]
+        return self.run('search', game_state, tasks)
+
+    def plan(self, game_state, roots, player_id, enemy_id, beam_width, action_groups, time_limit=None):
+        """把第一步的候选攻击分组，每组由一个工作进程做整回合规划，按组的顺序返回 plan_task 的结果（出错时为 None）"""
+        if isinstance(game_state, SearchState):
+            game_state, roots = game_state.compact(roots)
+        tasks = [(roots, player_id, enemy_id, beam_width, time_limit, group) for group in action_groups]
+        return self.run('plan', game_state, tasks)
+
+    def run(self, kind, game_state, tasks):
+        """
+        在同一个局面上执行一批 kind（TASKS 的键）任务，每个任务一个工作进程
+        - 任务中的对象编号是工作进程从快照恢复出的局面中的编号：SearchState 有阵亡的对象时先用 compact() 换算
+        """
+        with self.lock:
+            return self._run(kind, game_state, tasks)
+
+    def _run(self, kind, game_state, tasks):
+        if game_state.map is not self.game_map:
+            self.set_map(game_state.map)
+        self.start()
+        self._write_snapshot(game_state)
+
+        # 任务数可能多于进程数，分批发送
+        results = []
+        for begin in range(0, len(tasks), self.size):
+            batch = tasks[begin:begin + self.size]
+            pending = []
+            for worker, args in zip(self.workers, batch):
+                self.task_id += 1
+                try:
+                    send_message(worker.stdin, (kind, self.task_id, self.shm.name, args))
+                except OSError:
+                    pending.append((None, args))
+                    continue
+                pending.append((worker, args))
+            for worker, args in pending:
+                results.append(self._receive(kind, worker, args))
+        return results
+
+    def _receive(self, kind, worker, args):
+        reply = recv_message(worker.stdout) if worker else None
+        if reply is not None:
+            if reply[0] == 'error':
+                print(f"AI worker error: {reply[2]}")
+                return None
+            return reply[2]
+        # 进程崩溃：回收并重启，本次任务在主进程计算
+        print("AI worker crashed, restarting")
+        if worker:
+            worker.kill()
+            worker.wait()
+        self.start()
+        return TASKS[kind](SearchState.from_snapshot(self.shm.buf, self.game_map), *args)
+
+    def shutdown(self, timeout=1):
+        """通知所有工作进程退出，超时未退出的直接结束，并释放共享内存"""
+        for worker in self.workers:
+            try:
+                send_message(worker.stdin, ('stop',))
+                worker.stdin.close()
+            except OSError:
+                pass
+        for worker in self.workers:
+            try:
+                worker.wait(timeout)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+                worker.wait()
+            worker.stdout.close()
+        self.workers = []
+        self._release_snapshot()
+
+# endregion Worker Pool
 
 if __name__ == "__main__":
-    # 从命令行参数获取输入文件路径和输出文件路径
-    input_file = sys.argv[1]
-    output_file = sys.argv[2]
-    
-    # 读取输入数据
-    with open(input_file, 'rb') as f:
-        data = pickle.load(f)
-    
-    game_state_data = data['game_state']
-    unit_data = data['unit']
-    player_id = data['player_id']
-    enemy_id = data['enemy_id']
-    search_depth = data['search_depth']
-    actions = data['actions']  # 获取传入的行动列表
-    
-    # 执行搜索，传入行动列表
-    result = search_task(game_state_data, unit_data, player_id, enemy_id, search_depth, actions)
-    
-    # 写入结果
-    with open(output_file, 'wb') as f:
-        if result:
-            f.write(result)
\ No newline at end of file
+    serve()
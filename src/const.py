@@ -72,7 +72,7 @@ class HINTS:
     FILE_ERROR = 'Level file error.'
     SAVE = 'Game Saved'
     LOAD = 'Game Loaded'
-    AI = 'AI is thinking...'
+    AI = 'AI is thinking...  [C] Skip the rest of AI turn'
 
 # endregion View
 
@@ -105,6 +105,7 @@ class MoveType:
     Air = 3
     Sea = 4
     Sub = 5
+    COUNT = 6
 
 
 """
@@ -305,12 +306,22 @@ def draw_select_tile_rect(x, y, width=4):
 
 """Preload"""
 
-preload_unit_imgs = {}
-for png in os.listdir('assets/unit'):
-    if png.endswith('.png'):
-        preload_unit_imgs[png] = pygame.image.load(f'assets/unit/{png}')
-
-preload_terrain_imgs = {}
-for png in os.listdir('assets/terrain'):
-    if png.endswith('.png'):
-        preload_terrain_imgs[png] = pygame.image.load(f'assets/terrain/{png}')
+class PreloadImages(dict):
+    """按需加载的图片缓存：首次访问某个文件名时才读取，导入本模块时不碰磁盘也不初始化pygame"""
+    def __init__(self, folder):
+        super().__init__()
+        self.folder = folder
+
+    def __missing__(self, png):
+        img = pygame.image.load(f'{self.folder}/{png}')
+        self[png] = img
+        return img
+
+    def load_all(self):
+        """客户端启动时可一次性预加载整个目录，避免游戏过程中卡顿"""
+        for png in os.listdir(self.folder):
+            if png.endswith('.png') and png not in self:
+                self[png]
+
+preload_unit_imgs = PreloadImages('assets/unit')
+preload_terrain_imgs = PreloadImages('assets/terrain')
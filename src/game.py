@@ -1,9 +1,11 @@
 from const import *
-from units import Unit, Build
-import pygame
+from units import Unit, Build, TypeTable
+from zobrist import ZobristTable
 import random
 import math
+import heapq
 import pickle
+from array import array
 
 class GameMap:
     # 从文件中读取地形信息
@@ -15,6 +17,74 @@ class GameMap:
                 self.terrain.append([Terrain.CHAR_MAP[c] for c in line.strip().split()])
         self.width = len(self.terrain[0])
         self.height = len(self.terrain)
+        self.compile()
+
+    def compile(self):
+        """
+        把地形编译成扁平数组，下标为 y * width + x
+        - tiles: 地形类型
+        - move_cost[move_type]: 每种 MoveType 的移动消耗（-1 表示不可通行）
+        - defence: 防御系数
+        """
+        self.tiles = array('b', [terrain for row in self.terrain for terrain in row])
+        self.move_cost = [
+            array('d', [Terrain.PROPERTIES[terrain][f'move_cost_{move_type}'] for terrain in self.tiles])
+            for move_type in range(MoveType.COUNT)
+        ]
+        self.defence = array('d', [Terrain.PROPERTIES[terrain]['defence_factor'] for terrain in self.tiles])
+        # 每种 MoveType 在本地图上的最小正移动消耗，用来估计最远能走几步
+        self.min_move_cost = [min((cost for cost in costs if cost > 0), default=0) for costs in self.move_cost]
+        self._column_masks = {}
+
+    def max_steps(self, move_type, movement):
+        """移动力为 movement 时最多能走的格数（上界）"""
+        min_cost = self.min_move_cost[move_type]
+        return math.ceil(movement / min_cost) if min_cost > 0 else 0
+
+    def __getstate__(self):
+        # 编译出的数组不序列化，读取时重新编译（也兼容旧存档）
+        return {'terrain': self.terrain, 'width': self.width, 'height': self.height}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.compile()
+
+    def tile_bit(self, x, y):
+        """格子在位集（Python int，第 y * width + x 位）中对应的位"""
+        return 1 << (y * self.width + x)
+
+    def _column_mask(self, dx):
+        """水平平移 dx 后仍在同一行内的格子组成的位集（去掉换行的部分）"""
+        mask = self._column_masks.get(dx)
+        if mask is None:
+            row = 0
+            for x in range(max(0, dx), min(self.width, self.width + dx)):
+                row |= 1 << x
+            mask = 0
+            for y in range(self.height):
+                mask |= row << (y * self.width)
+            self._column_masks[dx] = mask
+        return mask
+
+    def dilate(self, bits, min_range, max_range):
+        """
+        用曼哈顿环形核膨胀位集：返回与 bits 中任一格距离在 [min_range, max_range] 之间的所有格子
+        先按 dx 分组做竖直平移，再统一做一次水平平移和列掩码
+        """
+        width = self.width
+        result = 0
+        for dx in range(-max_range, max_range + 1):
+            rest = max_range - abs(dx)
+            vertical = 0
+            for dy in range(-rest, rest + 1):
+                if abs(dx) + abs(dy) < min_range:
+                    continue
+                shift = dy * width
+                vertical |= bits << shift if shift >= 0 else bits >> -shift
+            if vertical:
+                shifted = vertical << dx if dx >= 0 else vertical >> -dx
+                result |= shifted & self._column_mask(dx)
+        return result
 
     def draw(self, screen, map_x , map_y):
         for y in range(max(map_y, 0), min(map_y + MAP_VIEW_SIZE, self.height)):
@@ -106,10 +176,158 @@ class Player:
                 build.attacked = False
 
 
+class ThreatMap:
+    """
+    每个玩家的威胁图：每个格子下回合可能被哪些敌方单位攻击到，以及潜在伤害
+    - 敌方单位不阻挡攻击者移动，也不检查防空/反潜等条件，所以结果是实际威胁的上界
+    - 单位移动、死亡、购买、受伤或建筑被占领时，只把影响范围覆盖该格的攻击者标记为脏，读取时再重算
+    - 深拷贝和存档时不保留缓存，需要时重新计算
+    """
+    def __init__(self):
+        self.built = False
+        self.records = {}    # 攻击者 -> (player_id, 可攻击的格子, 影响格子)
+        self.threats = {}    # 攻击者的 player_id -> {格子: {攻击者: 潜在伤害}}
+        self.influence = {}  # 攻击者的 player_id -> {格子: {攻击者}}
+        self.dirty = set()
+
+    def __deepcopy__(self, memo):
+        return ThreatMap()
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def mark(self, obj):
+        """单位本身发生变化（新增、移动、受伤、死亡）"""
+        if self.built and obj.attack_range[1] > 0:
+            self.dirty.add(obj)
+
+    def on_change(self, obj, width):
+        """obj 所在格的占用发生变化"""
+        if not self.built:
+            return
+        self.mark(obj)
+        index = obj.y * width + obj.x
+        # 单位只阻挡己方攻击者（敌方单位不阻挡），建筑对所有攻击者都可能是障碍
+        owners = self.influence.keys() if isinstance(obj, Build) else [obj.player_id]
+        for owner in owners:
+            self.dirty.update(self.influence.get(owner, {}).get(index, ()))
+
+    def refresh(self, gm):
+        if not self.built:
+            self.built = True
+            for player in gm.players + [gm.neutral_player]:
+                for obj in player.units + player.builds:
+                    if obj.attack_range[1] > 0:
+                        self._add(gm, obj)
+            return
+        for attacker in self.dirty:
+            self._remove(attacker)
+            grid = gm.build_grid if isinstance(attacker, Build) else gm.unit_grid
+            if grid.get((attacker.x, attacker.y)) is attacker:  # 仍然存活
+                self._add(gm, attacker)
+        self.dirty.clear()
+
+    def threats_at(self, player_id, index):
+        result = {}
+        for owner, threats in self.threats.items():
+            if owner != player_id and index in threats:
+                result.update(threats[index])
+        return result
+
+    def _add(self, gm, attacker):
+        attack_tiles, influence = gm._threat_reach(attacker)
+        potential = gm._potential_damage(attacker)
+        threats = self.threats.setdefault(attacker.player_id, {})
+        for index in attack_tiles:
+            threats.setdefault(index, {})[attacker] = potential
+        owner_influence = self.influence.setdefault(attacker.player_id, {})
+        for index in influence:
+            owner_influence.setdefault(index, set()).add(attacker)
+        self.records[attacker] = (attacker.player_id, attack_tiles, influence)
+
+    def _remove(self, attacker):
+        record = self.records.pop(attacker, None)
+        if record is None:
+            return
+        owner, attack_tiles, influence = record
+        threats, owner_influence = self.threats[owner], self.influence[owner]
+        for index in attack_tiles:
+            del threats[index][attacker]
+            if not threats[index]:
+                del threats[index]
+        for index in influence:
+            owner_influence[index].discard(attacker)
+            if not owner_influence[index]:
+                del owner_influence[index]
+
+
+class ReachCache:
+    """
+    移动和攻击范围的缓存，跨回合保留
+    - 每条记录带有一个区域位集（单位的最大影响范围），该区域内有格子的占用变化时才失效
+    - counter 记录命中、未命中和失效次数
+    - 深拷贝和存档时不保留缓存
+    """
+    def __init__(self):
+        self.entries = {}  # key -> (区域位集, (possible_moves, possible_attacks))
+        self.counter = Counter()
+
+    def __deepcopy__(self, memo):
+        return ReachCache()
+
+    def __getstate__(self):
+        return {}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.counter.increment('miss')
+            return None
+        self.counter.increment('hit')
+        return entry[1]
+
+    def put(self, key, region, result):
+        self.entries[key] = (region, result)
+
+    def invalidate(self, bit):
+        """bit 所在格的占用发生变化"""
+        stale = [key for key, (region, _) in self.entries.items() if region & bit]
+        for key in stale:
+            del self.entries[key]
+        self.counter.increment('invalidated', len(stale))
+
+
 class GameManager:
-    def __init__(self, level=1):
+    # 客户端钩子：音效播放函数 on_sound(file)，由 main 设置；为 None 时静默（AI 进程、批处理工具）
+    on_sound = None
+
+    def __init__(self, level=1, seed=None):
+        """seed: 本局幸运值的随机种子，默认随机选取；记录在 self.seed 中，用同一种子可以重现整局"""
+        self._init_board(level, GameMap(f"assets/map/map{level}.txt"), seed)
+        self.read_units(f"assets/map/unit{level}.txt")
+        for i, player in enumerate(self.players):
+            if i != self.cur_player_id:
+                player.reset_units(True)
+
+    @classmethod
+    def empty(cls, game_map, level=None):
+        """没有任何单位和建筑的局面，用于从快照等外部数据恢复"""
+        gm = cls.__new__(cls)
+        gm._init_board(level, game_map)
+        return gm
+
+    def _init_board(self, level, game_map, seed=None):
         self.level = level
-        self.map = GameMap(f"assets/map/map{level}.txt")
+        self.map = game_map
+        # 本局专用的随机数发生器，只用于幸运值（音效等表现用全局 random），随存档一起保存
+        self.seed = random.randrange(1 << 32) if seed is None else seed
+        self.rng = random.Random(self.seed)
         self._init_view() 
         self.players = [Player(0), Player(1)]
         self.neutral_player = Player(-1)
@@ -118,10 +336,14 @@ class GameManager:
         self.selected_unit: Unit = None
         self.possible_moves = set()  # 所有可到达的点（不含起点）
         self.possible_attacks = []  # 元素是 ((from_x,from_y), (to_x,to_y), target_unit) 的元组
-        self.read_units(f"assets/map/unit{level}.txt")
-        for i, player in enumerate(self.players):
-            if i != self.cur_player_id:
-                player.reset_units(True)
+        # 空间索引：坐标 -> 单位 / 建筑（每格最多一个单位和一个建筑）
+        self.unit_grid = {}
+        self.build_grid = {}
+        # 占用位集：player_id -> 位集，单位和建筑分开记录
+        self.unit_bits = {-1: 0, 0: 0, 1: 0}
+        self.build_bits = {-1: 0, 0: 0, 1: 0}
+        self.threat_map = ThreatMap()
+        self._init_caches()
         self.effects = []
         self.ai_id = None
 
@@ -132,10 +354,183 @@ class GameManager:
         else:
             self.map_x = 0
         self.map_y = self.map.height // 2 - MAP_VIEW_SIZE // 2  
+    def _init_caches(self):
+        # 局面版本号：单位的位置、归属、血量或回合变化时加一，用于缓存失效
+        self.board_version = 0
+        self._warning_cache = {}  # (board_version, selected_unit, coords) -> warning_list
+        self.reach_cache = ReachCache()
+
+    def _play_sound(self, file):
+        hook = GameManager.on_sound
+        if hook is not None:
+            hook(file)
+
     def cur_player(self) -> Player:
         """返回当前玩家"""
         return self.players[self.cur_player_id]
 
+    def get_player(self, player_id) -> Player:
+        """根据 id 返回玩家，-1 表示中立"""
+        return self.neutral_player if player_id == -1 else self.players[player_id]
+
+    def add_unit(self, player_id, x, y, unit_type, tired=False):
+        new_unit = self.get_player(player_id).add_unit(x, y, unit_type, tired)
+        self._index_add(new_unit)
+        return new_unit
+
+    def add_build(self, player_id, x, y, build_type):
+        new_build = self.get_player(player_id).add_build(x, y, build_type)
+        self._index_add(new_build)
+        return new_build
+
+    # region Spatial Index
+    def _index_add(self, obj):
+        if isinstance(obj, Build):
+            grid, bits = self.build_grid, self.build_bits
+        else:
+            grid, bits = self.unit_grid, self.unit_bits
+        bit = self.map.tile_bit(obj.x, obj.y)
+        old = grid.get((obj.x, obj.y))
+        if old is not None:
+            bits[old.player_id] &= ~bit
+        grid[(obj.x, obj.y)] = obj
+        bits[obj.player_id] |= bit
+        self.board_version += 1
+        self.reach_cache.invalidate(bit)
+        self.threat_map.on_change(obj, self.map.width)
+
+    def _index_remove(self, obj):
+        if isinstance(obj, Build):
+            grid, bits = self.build_grid, self.build_bits
+        else:
+            grid, bits = self.unit_grid, self.unit_bits
+        if grid.get((obj.x, obj.y)) is obj:
+            bit = self.map.tile_bit(obj.x, obj.y)
+            del grid[(obj.x, obj.y)]
+            bits[obj.player_id] &= ~bit
+            self.board_version += 1
+            self.reach_cache.invalidate(bit)
+            self.threat_map.on_change(obj, self.map.width)
+
+    def _rebuild_index(self):
+        """根据玩家的单位列表重建空间索引（读档时调用）"""
+        self.unit_grid = {}
+        self.build_grid = {}
+        self.unit_bits = {-1: 0, 0: 0, 1: 0}
+        self.build_bits = {-1: 0, 0: 0, 1: 0}
+        self.threat_map = ThreatMap()
+        for player in self.players + [self.neutral_player]:
+            for obj in player.builds + player.units:
+                self._index_add(obj)
+
+    def _relocate(self, obj, x, y):
+        """移动单位并同步空间索引"""
+        self._index_remove(obj)
+        obj.x, obj.y = x, y
+        self._index_add(obj)
+
+    def _transfer_build(self, build, player_id):
+        """改变建筑归属（占领），建筑所在格不变"""
+        self._index_remove(build)
+        self.get_player(build.player_id).builds.remove(build)
+        self.get_player(player_id).builds.append(build)
+        build.player_id = player_id
+        self._index_add(build)
+
+    # region Threat Map
+    def get_threats(self, player_id, x, y):
+        """返回 {敌方单位: 潜在伤害}，表示下回合可能攻击到 player_id 在 (x, y) 的单位的敌方单位"""
+        self.threat_map.refresh(self)
+        return self.threat_map.threats_at(player_id, y * self.map.width + x)
+
+    def get_threat_damage(self, player_id, x, y):
+        """(x, y) 上 player_id 的单位下回合可能受到的总潜在伤害"""
+        return sum(self.get_threats(player_id, x, y).values())
+
+    def _potential_damage(self, source):
+        """不考虑目标的潜在伤害：取幸运系数的期望，不计地形和装甲"""
+        health_percentage = math.ceil(source.health / source.max_health * 10) / 10
+        global_factor = 1.0 if source.attack_range[0] > 1 else 1.1
+        return health_percentage * (source.attack + 4.5) * global_factor
+
+    def _threat_reach(self, attacker):
+        """
+        计算攻击者下回合的威胁范围（忽略 moved / attacked，敌方单位不阻挡移动）
+        返回 (可攻击的格子, 影响其可达范围的格子)，均为扁平下标
+        """
+        width = self.map.width
+        start = attacker.y * width + attacker.x
+        min_range, max_range = attacker.attack_range
+        if min_range > 1 or attacker.movement <= 0:  # 远程兵种只能原地攻击
+            reach = {start}
+            influence = {start}
+        else:
+            occupied = self._occupied_tiles(attacker, attacker.player_id)
+            reach = self._search_reachable(attacker, attacker.movement, occupied)
+            # 可达格子及其邻格的占用变化都可能改变可达范围
+            influence = set(reach)
+            for index in reach:
+                y, x = divmod(index, width)
+                if x > 0: influence.add(index - 1)
+                if x + 1 < width: influence.add(index + 1)
+                if y > 0: influence.add(index - width)
+                if y + 1 < self.map.height: influence.add(index + width)
+        reach_bits = 0
+        for index in reach:
+            reach_bits |= 1 << index
+        attack_bits = self.map.dilate(reach_bits, min_range, max_range)
+        attack_tiles = []
+        while attack_bits:
+            low_bit = attack_bits & -attack_bits
+            attack_bits ^= low_bit
+            attack_tiles.append(low_bit.bit_length() - 1)
+        return attack_tiles, influence
+    # endregion Threat Map
+
+    def enemy_bits(self, player_id):
+        """除 player_id 以外所有玩家（含中立）的单位和建筑所在格的位集"""
+        bits = 0
+        for other_id in self.unit_bits:
+            if other_id != player_id:
+                bits |= self.unit_bits[other_id] | self.build_bits[other_id]
+        return bits
+
+    def unit_at(self, x, y) -> Unit:
+        return self.unit_grid.get((x, y))
+
+    def build_at(self, x, y) -> Build:
+        return self.build_grid.get((x, y))
+
+    def objects_at(self, x, y):
+        """返回该格上的单位和建筑（单位在前）"""
+        return [obj for obj in (self.unit_grid.get((x, y)), self.build_grid.get((x, y))) if obj]
+
+    def tiles_in_range(self, x, y, min_range, max_range):
+        """地图内所有与 (x, y) 曼哈顿距离在 [min_range, max_range] 之间的格子"""
+        for dy in range(-max_range, max_range + 1):
+            ty = y + dy
+            if not 0 <= ty < self.map.height:
+                continue
+            rest = max_range - abs(dy)
+            for dx in range(-rest, rest + 1):
+                tx = x + dx
+                if abs(dx) + abs(dy) < min_range or not 0 <= tx < self.map.width:
+                    continue
+                yield tx, ty
+
+    def objects_in_range(self, x, y, min_range, max_range):
+        """
+        返回曼哈顿距离在 [min_range, max_range] 之间的所有单位和建筑
+        范围内格子比单位还多时直接遍历索引
+        """
+        area = 2 * max_range * (max_range + 1) + 1
+        if area > len(self.unit_grid) + len(self.build_grid):
+            return [obj for grid in (self.unit_grid, self.build_grid) for (tx, ty), obj in grid.items()
+                    if min_range <= abs(tx - x) + abs(ty - y) <= max_range]
+        return [obj for tx, ty in self.tiles_in_range(x, y, min_range, max_range)
+                for obj in self.objects_at(tx, ty)]
+    # endregion Spatial Index
+
     def read_units(self, file):
         """从文件中读取单位信息"""
         with open(file, 'r') as f:
@@ -147,11 +542,11 @@ class GameManager:
                 x, y, player_id = int(x), int(y), int(player_id)
                 if player_id != -1:
                     if unit_type in Unit.PROPERTIES:
-                        self.players[player_id].add_unit(x, y, unit_type)
+                        self.add_unit(player_id, x, y, unit_type)
                     elif unit_type in Build.PROPERTIES:
-                        self.players[player_id].add_build(x, y, unit_type)
+                        self.add_build(player_id, x, y, unit_type)
                 else:
-                    self.neutral_player.add_build(x, y, unit_type)
+                    self.add_build(player_id, x, y, unit_type)
 
     def save(self, filename='savegame.pkl'):
         """Serialize this GameManager (and all its maps/units/players) to disk."""
@@ -167,19 +562,24 @@ class GameManager:
         """
         with open(filename, 'rb') as f:
             gm: GameManager = pickle.load(f)
+        if 'rng' not in gm.__dict__:  # 旧存档没有本局的随机数发生器
+            gm.seed = random.randrange(1 << 32)
+            gm.rng = random.Random(gm.seed)
         gm._init_view()
+        gm._init_caches()
+        gm._rebuild_index()
         print(f"[Loaded] Game state read from {filename}")
         return gm
     
     def next_turn(self):
+        self.board_version += 1
         self.players[self.cur_player_id].reset_units(True)
         self.cur_player_id = (self.cur_player_id + 1) % len(self.players)
         if self.cur_player_id == 0:
             self.turn += 1
         self.players[self.cur_player_id].reset_units()
         for build in self.cur_player().builds:
-            if hasattr(build, 'income'):
-                self.cur_player().money += build.income
+            self.cur_player().money += build.income
         self.deselect()
 
     def select_unit(self, x, y, right_click=False):
@@ -187,26 +587,25 @@ class GameManager:
         - 根据坐标判断能否选中（优先选择单位），如果可以就设置 selected_unit 
         - 调用 calculate_possible_moves 搜索移动和攻击范围
         """
-        for player in self.players:
-            is_cur_player = player.id == self.cur_player_id
-            for unit in player.units:
-                if unit.x == x and unit.y == y:
-                    self.selected_unit = unit
-                    # 如果单位移动过，或者是右键预览状态，就不考虑移动
-                    # 远程兵种（最小范围大于1）移动后不能攻击，考虑移动和原地攻击
-                    # 如果具有blitz属性且已经攻击，限制移动点数为 1
-                    override_movement = 1 if hasattr(unit, 'blitz') and unit.attacked and is_cur_player else None
-                    self._calculate_possible_moves(unit.moved and is_cur_player, 
-                                                   unit.attack_range[0]>1, override_movement)
-                    return True
-            for build in player.builds:
-                if right_click and build.shop_type != SHOP_TYPE.NONE:
-                    continue
-                if build.x == x and build.y == y:
-                    self.selected_unit = build
-                    if build.attack_range[1] > 0:
-                        self._calculate_possible_moves(True, True)
-                    return True
+        unit = self.unit_at(x, y)
+        if unit:
+            is_cur_player = unit.player_id == self.cur_player_id
+            self.selected_unit = unit
+            # 如果单位移动过，或者是右键预览状态，就不考虑移动
+            # 远程兵种（最小范围大于1）移动后不能攻击，考虑移动和原地攻击
+            # 如果具有blitz属性且已经攻击，限制移动点数为 1
+            override_movement = 1 if unit.blitz and unit.attacked and is_cur_player else None
+            self._calculate_possible_moves(unit.moved and is_cur_player, 
+                                           unit.attack_range[0]>1, override_movement)
+            return True
+        build = self.build_at(x, y)
+        if build and build.player_id != -1:  # 中立建筑不能选中
+            if right_click and build.shop_type != SHOP_TYPE.NONE:
+                return False
+            self.selected_unit = build
+            if build.attack_range[1] > 0:
+                self._calculate_possible_moves(True, True)
+            return True
         return False
     
     def move_selected_unit(self, x, y, is_simulation=False):
@@ -216,12 +615,11 @@ class GameManager:
         return: 单位是否可以继续操作（即是否要求保持选中状态）
         """
         if (x, y) in self.possible_moves:
-            self.selected_unit.x = x
-            self.selected_unit.y = y
+            self._relocate(self.selected_unit, x, y)
             self.selected_unit.moved = True
 
             if not is_simulation:
-                play_sound(f"assets/sound/effect/move_{self.selected_unit.move_type}_{random.randint(0, 1)}.mp3")
+                self._play_sound(f"assets/sound/effect/move_{self.selected_unit.move_type}_{random.randint(0, 1)}.mp3")
 
             # 远程兵种（最大范围大于1）移动后不能攻击
             if self.selected_unit.attack_range[0] > 1:
@@ -267,19 +665,16 @@ class GameManager:
         else:
             # 陆地单位在水上不能攻击
             if source.move_type < 3:
-                # 注意terrain的索引顺序
-                if self.map.terrain[source_moved_position[1]][source_moved_position[0]] == Terrain.WATER:
+                if self.map.tiles[source_moved_position[1] * self.map.width + source_moved_position[0]] == Terrain.WATER:
                     return False
-            # 防空
-            if target.move_type == MoveType.Air and not hasattr(source, 'anti_air'):
-                return False
-            # 反潜
-            if target.move_type == MoveType.Sub and not hasattr(source, 'anti_sub'):
+            # 防空、反潜
+            if not TypeTable.can_attack[source.type_id * TypeTable.type_count + target.type_id]:
                 return False
         return True
 
     def _unit_die(self, target: Unit):
         self.effects.append(Effect(target.x, target.y, EffectType.Death))
+        self._index_remove(target)
         if target.player_id == -1:
             self.neutral_player.builds.remove(target)
         elif isinstance(target, Build):
@@ -298,7 +693,7 @@ class GameManager:
             # 移动和攻击分两步点击，不支持一步到位
             if pair[1] == (x, y) and pair[0] == (self.selected_unit.x, self.selected_unit.y):
                 if not is_simulation:
-                    play_sound(f"assets/sound/effect/attack_{random.randint(0, 2)}.mp3")  # 播放攻击音效
+                    self._play_sound(f"assets/sound/effect/attack_{random.randint(0, 2)}.mp3")  # 播放攻击音效
                 source: Unit = self.selected_unit
                 source.attacked = True
                 target: Unit = pair[2]
@@ -306,27 +701,23 @@ class GameManager:
                 if isinstance(target, Build) and target.capturable and\
                     source.move_type == MoveType.Feet and target.player_id != source.player_id:
                     # 敌方建筑变成中立，中立建筑变成我方
-                    if target.player_id >= 0:
-                        self.neutral_player.builds.append(target)
-                        self.players[target.player_id].builds.remove(target)
-                        target.player_id = -1
-                    else:
-                        self.players[source.player_id].builds.append(target)
-                        self.neutral_player.builds.remove(target)
-                        target.player_id = source.player_id
+                    self._transfer_build(target, -1 if target.player_id >= 0 else source.player_id)
                     source.moved = True
                     return False
                 damage = self._calculate_damage(source, target)
                 target.health -= damage
+                self.board_version += 1
+                self.threat_map.mark(target)
                 if target.health <= 0:
                     self._unit_die(target)
                 else: # 反击
                     if self._can_attack(target, source):
                         damage = self._calculate_damage(target, source)
                         source.health -= damage
+                        self.threat_map.mark(source)
                         if source.health <= 0:
                             self._unit_die(source)
-                if hasattr(source, 'blitz'):
+                if source.blitz:
                     # 如果具有blitz特性，攻击后恢复可移动状态，但移动点数为1
                     source.moved = False
                     self._calculate_possible_moves(False, True, 1)
@@ -336,6 +727,23 @@ class GameManager:
                     return False
         return False
 
+    def position_hash(self):
+        """
+        局面的 Zobrist 哈希，与 SearchState.hash 对同一局面的结果相同
+        GameManager 的修改分散在各处，这里从头计算（O(单位数)）；搜索中的增量维护在 SearchState 里
+        """
+        zobrist = ZobristTable.for_size(self.map.width * self.map.height)
+        result = zobrist.side_key(self.cur_player_id)
+        for player in self.players + [self.neutral_player]:
+            result ^= zobrist.money_key(player.id, player.money)
+            for unit in player.units:
+                result ^= zobrist.object_key(unit.type_id, player.id, unit.y * self.map.width + unit.x,
+                                             unit.health, unit.moved | unit.attacked << 1)
+            for build in player.builds:
+                result ^= zobrist.object_key(build.type_id, player.id, build.y * self.map.width + build.x,
+                                             build.health, build.moved | build.attacked << 1 | build.build_stacked << 2)
+        return result
+
     def check_game_over(self):
         winners = []
         flag = False
@@ -355,126 +763,166 @@ class GameManager:
         self.possible_attacks = []
 
     def _calculate_damage(self, source: Unit, target: Unit):
+        """类型和地形相关的系数查 TypeTable 的预计算表，幸运值由本局的 rng 抽取"""
         health_percentage = math.ceil(source.health / source.max_health * 10) / 10
-        luck = random.randint(0, 9) # 幸运系数
-        terrain_factor = 1-Terrain.PROPERTIES[self.map.terrain[target.y][target.x]]['defence_factor']
-        weapon_diff = source.weapon_type-target.armor_type
-        if weapon_diff > 0:
-            armor_factor = 1 + 0.0 * weapon_diff # 强打弱增益系数
-        else:
-            armor_factor = 1 + 0.15 * weapon_diff # 弱打强衰减系数
-        global_factor = 1.0 if source.attack_range[0] > 1 else 1.1 # 全局系数，远程近程区别对待
-        if not isinstance(target, Build):
-            # 飞机打非空中的防空单位衰减伤害
-            if source.move_type == MoveType.Air and target.move_type != MoveType.Air and hasattr(target, 'anti_air'):
-                global_factor *= 0.8
-            # 非海军单位打海军单位衰减伤害
-            if source.move_type < 3 and target.move_type == MoveType.Sea:
-                global_factor *= 0.8
-        return health_percentage * (source.attack + luck) * (terrain_factor * armor_factor) * global_factor
+        luck = self.rng.randint(0, 9) # 幸运系数
+        pair = source.type_id * TypeTable.type_count + target.type_id
+        terrain = self.map.tiles[target.y * self.map.width + target.x]
+        return health_percentage * (source.attack + luck) * \
+            TypeTable.terrain_damage[pair * TypeTable.terrain_count + terrain] * TypeTable.global_damage[pair]
+
+    def _occupied_tiles(self, unit, blocking_player_id=None):
+        """
+        对 unit 来说不可进入的格子（扁平下标 y * width + x）
+        blocking_player_id: 只把该玩家的单位当作障碍（威胁图用），默认所有单位都是障碍
+        """
+        width = self.map.width
+        occupied = {y * width + x for (x, y), other in self.unit_grid.items()
+                    if blocking_player_id is None or other.player_id == blocking_player_id}
+        occupied.update(
+            y * width + x for (x, y), build in self.build_grid.items()
+            if not build.stackable or build.player_id != unit.player_id
+        )
+        return occupied
+
+    def _search_reachable(self, unit, movement, occupied):
+        """
+        Dijkstra 搜索 unit 从当前位置出发能到达的所有格子（含起点），返回扁平下标的集合
+        按剩余移动力从大到小出堆，每个格子只展开一次
+        """
+        width, height = self.map.width, self.map.height
+        cost_grid = self.map.move_cost[unit.move_type]
+        start = unit.y * width + unit.x
+        heap = [(-movement, start)]  # heapq 是最小堆，存负的剩余移动力
+        best_remain = {start: movement}
+        settled = set()
+        while heap:
+            neg_remain, index = heapq.heappop(heap)
+            if index in settled:
+                continue
+            settled.add(index)
+            remain_movement = -neg_remain
+            # 如果移动力不足，不能再扩展
+            if remain_movement <= 0:
+                continue
+            y, x = divmod(index, width)
+            for neighbor, inside in ((index + width, y + 1 < height), (index + 1, x + 1 < width),
+                                     (index - width, y > 0), (index - 1, x > 0)):
+                # 如果超出地图边界，已被占用或已确定最优，跳过
+                if not inside or neighbor in occupied or neighbor in settled:
+                    continue
+                cost = cost_grid[neighbor]
+                if cost < 0:
+                    continue  # 无法通行
+                new_remain = remain_movement - cost
+                if new_remain > best_remain.get(neighbor, -0.1): # 调整这个值让最后一步可以欠费
+                    best_remain[neighbor] = new_remain
+                    heapq.heappush(heap, (-new_remain, neighbor))
+        return settled
 
     def _calculate_possible_moves(self, skip_move=False, attack_without_move=False, override_movement=None):
         """
         搜索所有可能的移动和攻击位置
         skip_move: 不搜索移动（适用于已经移动的单位或者右键预览攻击范围，只考虑原地攻击）
         attack_without_move: 只搜索原地攻击（适用于移动后不能攻击的单位，考虑移动和原地攻击）
+        结果按 (单位, 位置, 参数) 缓存在 reach_cache 中，直到单位的最大影响范围内有格子的占用发生变化
         """
-        self.possible_moves = set()  # 所有可到达的点（不含起点）
-        self.possible_attacks = []  # 元素是 ((from_x,from_y), (to_x,to_y), target_unit) 的元组
-
         unit = self.selected_unit
+        key = (unit, unit.x, unit.y, skip_move, attack_without_move, override_movement)
+        cached = self.reach_cache.get(key)
+        if cached is None:
+            cached = self._search_possible_moves(unit, skip_move, attack_without_move, override_movement)
+            region = self.map.dilate(self.map.tile_bit(unit.x, unit.y), 0,
+                                     self._reach_radius(unit, skip_move, attack_without_move, override_movement))
+            self.reach_cache.put(key, region, cached)
+        moves, attacks = cached
+        self.possible_moves = set(moves)  # 所有可到达的点（不含起点）
+        self.possible_attacks = list(attacks)  # 元素是 ((from_x,from_y), (to_x,to_y), target_unit) 的元组
+
+    def _reach_radius(self, unit, skip_move, attack_without_move, override_movement):
+        """_search_possible_moves 的结果只依赖这个曼哈顿半径以内格子的占用情况"""
+        movement = override_movement if override_movement else unit.movement
+        move_radius = 0 if skip_move else self.map.max_steps(unit.move_type, movement)
+        if override_movement:
+            return move_radius
+        attack_radius = (0 if attack_without_move else move_radius) + unit.attack_range[1]
+        return max(move_radius, attack_radius)
+
+    def _search_possible_moves(self, unit, skip_move, attack_without_move, override_movement):
+        """_calculate_possible_moves 的实际搜索，返回 (possible_moves, possible_attacks)"""
+        possible_moves = set()
+        possible_attacks = []
         movement = override_movement if override_movement else unit.movement
         attack_range = unit.attack_range
 
         # 1. Dijkstra 搜索最佳路径
         if not skip_move:
-            queue = [(unit.x, unit.y, movement)]
-            best_remain = {(unit.x, unit.y): movement}
-            occupied = [
-                (other.x, other.y)
-                for player in self.players
-                for other in player.units
-            ]
-            occupied += [
-                (build.x, build.y)
-                for player in self.players
-                for build in player.builds if not build.stackable or build.player_id != unit.player_id
-            ]
-            occupied += [
-                (build.x, build.y)
-                for build in self.neutral_player.builds
-            ]
-
-            while queue:
-                x, y, remain_movement = queue.pop(0)
-                if remain_movement < best_remain.get((x, y), 0):
-                    continue                
+            width = self.map.width
+            start = unit.y * width + unit.x
+            for index in self._search_reachable(unit, movement, self._occupied_tiles(unit)):
                 # 跳过起点本身加入移动列表（但后面计算攻击时仍会把它考虑进去）
-                if (x, y) != (unit.x, unit.y):
-                    self.possible_moves.add((x, y))
-                # 如果移动力不足，不能再扩展
-                if remain_movement <= 0:
-                    continue
-                for dx, dy in [(0,1), (1,0), (0,-1), (-1,0)]:
-                    nx, ny = x + dx, y + dy
-                    # 如果超出地图边界，跳过
-                    if not (0 <= nx < self.map.width and 0 <= ny < self.map.height):
-                        continue
-                    # 如果已被占用，跳过
-                    if (nx, ny) in occupied:
-                        continue
-                    cost = Terrain.PROPERTIES[self.map.terrain[ny][nx]][f'move_cost_{unit.move_type}']
-                    if cost < 0:
-                        continue  # 无法通行
-                    new_remain = remain_movement - cost
-                    if new_remain > best_remain.get((nx, ny), -0.1): # 调整这个值让最后一步可以欠费
-                        best_remain[(nx, ny)] = new_remain
-                        queue.append((nx, ny, new_remain))
+                if index != start:
+                    possible_moves.add((index % width, index // width))
 
         if override_movement:  # 跳过攻击
-            return
+            return possible_moves, possible_attacks
         
         # 把起始位置也当作“移动”点，允许原地攻击
-        all_moves: set = {(unit.x, unit.y)} if attack_without_move else {(unit.x, unit.y)} | self.possible_moves
+        all_moves: set = {(unit.x, unit.y)} if attack_without_move else {(unit.x, unit.y)} | possible_moves
 
-        # 2. 对每个移动点，计算所有满足曼哈顿距离的攻击目标
+        # 2. 一次膨胀得到所有可攻击到的格子，与敌方占用位集求交后，只对剩下的目标检查攻击条件
+        min_range, max_range = attack_range
+        if max_range <= 0:
+            return possible_moves, possible_attacks
+        width = self.map.width
+        move_bits = 0
         for (mx, my) in all_moves:
-            # 在攻击范围内的所有相对偏移
-            min_range, max_range = attack_range
-            for dx in range(-max_range, max_range + 1):
-                for dy in range(-max_range, max_range + 1):
-                    manhattan_dist = abs(dx) + abs(dy)
-                    # 检查是否在最小和最大攻击范围之间
-                    if manhattan_dist < min_range or manhattan_dist > max_range:
-                        continue
-                    tx, ty = mx + dx, my + dy
-                    # 检查是否在地图边界内
-                    if not (0 <= tx < self.map.width and 0 <= ty < self.map.height):
-                        continue
-                    # 如果该格有敌方单位，则记录一次"从 mx,my 攻击 tx,ty"
-                    for i, player in enumerate(self.players + [self.neutral_player]):
-                        if i == unit.player_id:
-                            continue
-                        for enemy in (player.units+player.builds):  # 优先选择单位作为目标
-                            if (enemy.x, enemy.y) == (tx, ty) and self._can_attack(unit, enemy, True, (mx, my)):
-                                # 记录格式：((移动点x, 移动点y), (目标点x, 目标点y), 目标单位)
-                                pair = ((mx, my), (tx, ty), enemy)
-                                if pair not in self.possible_attacks:
-                                    self.possible_attacks.append(pair)
-                                break
+            move_bits |= 1 << (my * width + mx)
+        target_bits = self.map.dilate(move_bits, min_range, max_range) & self.enemy_bits(unit.player_id)
+        while target_bits:
+            low_bit = target_bits & -target_bits
+            target_bits ^= low_bit
+            ty, tx = divmod(low_bit.bit_length() - 1, width)
+            enemies = [enemy for enemy in self.objects_at(tx, ty) if enemy.player_id != unit.player_id]
+            # 反过来找能打到该目标的移动点
+            for mx, my in self.tiles_in_range(tx, ty, min_range, max_range):
+                if not move_bits >> (my * width + mx) & 1:
+                    continue
+                for enemy in enemies:  # 优先选择单位作为目标
+                    if self._can_attack(unit, enemy, True, (mx, my)):
+                        # 记录格式：((移动点x, 移动点y), (目标点x, 目标点y), 目标单位)
+                        possible_attacks.append(((mx, my), (tx, ty), enemy))
+                        break
+        return possible_moves, possible_attacks
 
     def get_warning_list(self, coords):
         """
         获取所有可能攻击到指定单位的敌方单位列表
         返回格式: [(x, y), ...] 表示可能攻击到该单位的敌方单位坐标列表
+        结果按 (局面版本, 选中单位, 坐标) 缓存，右键拖动时每帧调用也只在换格或局面变化时重新计算
         """
+        key = (self.board_version, self.selected_unit, coords)
+        if key not in self._warning_cache:
+            if any(cached_key[0] != self.board_version for cached_key in self._warning_cache):
+                self._warning_cache.clear()
+            self._warning_cache[key] = self._calculate_warning_list(coords)
+        return list(self._warning_cache[key])
+
+    def _calculate_warning_list(self, coords):
         warning_list = []
-        # 暂存当前选择状态
         original_selected: Unit = self.selected_unit
+        # 威胁图给出的是上界，只对其中的敌方单位做精确检查
+        candidates = self.get_threats(original_selected.player_id, *coords)
+        if not candidates:
+            return warning_list
+        # 暂存当前选择状态（预览结束后局面完全恢复，版本号也恢复）
+        version = self.board_version
         original_position = original_selected.x, original_selected.y
         original_moves = self.possible_moves.copy()
         original_attacks = self.possible_attacks.copy()
-        original_selected.x, original_selected.y = coords
+        # 临时把单位放到预览位置（该格原有的单位暂时让出索引）
+        displaced = self.unit_at(*coords)
+        self._relocate(original_selected, *coords)
         # 取消当前选择
         self.deselect()
         # 遍历所有敌方玩家
@@ -483,7 +931,7 @@ class GameManager:
                 continue  # 跳过自己的单位  
             # 检查敌方所有单位
             for enemy in player.units + player.builds:
-                if enemy.attack_range[1] < 1:
+                if enemy not in candidates:
                     continue  # 跳过无法攻击的单位
                 # 直接设置选中的单位
                 self.selected_unit = enemy
@@ -495,10 +943,13 @@ class GameManager:
                         warning_list.append((enemy.x, enemy.y))
                         break
         # 恢复原始状态
-        original_selected.x, original_selected.y = original_position
+        self._relocate(original_selected, *original_position)
+        if displaced and displaced is not original_selected:
+            self._index_add(displaced)
         self.selected_unit = original_selected
         self.possible_moves = original_moves
         self.possible_attacks = original_attacks
+        self.board_version = version
         return warning_list
 
     def buy_item(self, item, x, y) -> bool:
@@ -506,11 +957,14 @@ class GameManager:
         检查当前玩家的钱够不够购买物品
         """
         player = self.cur_player()
-        if item in Unit.PROPERTIES.keys():
-            if player.money < Unit.PROPERTIES[item]['price']:
+        if item in Unit.TYPES:
+            price = TypeTable.price[TypeTable.ids[item]]
+            if player.money < price:
+                return False
+            if self.unit_at(x, y):  # 每格只能有一个单位
                 return False
-            player.add_unit(x, y, item, True)
-            player.money -= Unit.PROPERTIES[item]['price']
+            self.add_unit(player.id, x, y, item, True)
+            player.money -= price
             return True
         else:  # 选择了不存在的单位
             print(f"{item} not found in shop.")
@@ -608,16 +1062,3 @@ class Shop:
                 return self.items[index]
         self._last_got_item_ind = -1
         return None
-
-        
-
-
-"""Helpers"""
-
-def play_sound(file, volume=0.5):
-    try:
-        sound = pygame.mixer.Sound(file)
-        sound.set_volume(volume)
-        sound.play()
-    except Exception as e:
-        print(f"Error playing sound: {e}")
\ No newline at end of file
@@ -1,6 +1,7 @@
 from pygame.locals import *
 from random import randint
 from ai import GameAI
+from ai_worker import WorkerPool
 from const import *
 from game import *
 import pygame
@@ -36,6 +37,8 @@ except: pass
 """Global Variables"""
 
 gm: GameManager = None
+ai: GameAI = None
+ai_pool = WorkerPool()  # AI 搜索进程池，启动时（菜单阶段）预热，多局之间复用
 frameclock = pygame.time.Clock()
 cur_state = GameState.PLAYING if is_debug else GameState.MENU
 bgm_list = os.listdir('assets/sound/bgm')
@@ -70,6 +73,19 @@ drag_start_map_pos = None
 pygame.mixer.init()
 pygame.mixer.music.set_volume(0.05)
 
+def play_sound(file, volume=0.5):
+    try:
+        sound = pygame.mixer.Sound(file)
+        sound.set_volume(volume)
+        sound.play()
+    except Exception as e:
+        print(f"Error playing sound: {e}")
+
+# 规则核心不依赖 pygame，音效和贴图由客户端注入
+GameManager.on_sound = play_sound
+preload_unit_imgs.load_all()
+preload_terrain_imgs.load_all()
+
 # 搜索可用关卡
 available_levels = []
 for file in os.listdir("assets/map"):
@@ -97,8 +113,7 @@ def show_hint(str, time=HINT_COUNTER_DEF):
     global info_string, hint_counter
     if str in HINTS.__dict__.values():
         info_string = [str, '']
-        if time != -1:
-            hint_counter = time
+        hint_counter = time if time != -1 else 0
 
 
 def play_bgm():
@@ -134,11 +149,24 @@ def select_and_interact(grid_x, grid_y):
     else:
         return False
 
+def create_ai():
+    """为当前的 gm 创建 GameAI，原来的 AI（及其后台线程）停止"""
+    global ai
+    if ai:
+        ai.stop(0)
+    ai = GameAI(gm, render_playing_state, pool=ai_pool)
+
+def is_ai_turn():
+    return gm.ai_id is not None and gm.cur_player_id == gm.ai_id
+
 def quit_game():
     try:
         ctypes.windll.user32.ActivateKeyboardLayout(original_hkl, KLF_SETFORPROCESS)
     except: pass
     finally:
+        if ai:
+            ai.stop(0.1)
+        ai_pool.shutdown()
         pygame.quit()
         sys.exit()
 
@@ -152,10 +180,8 @@ def render_playing_state(update=False):
         for build in player.builds:
             # 更新重叠状态（这个变量似乎没有存在的必要，因为_calculate_possible_moves考虑攻击时优先考虑单位）
             if build.stackable:
-                build.build_stacked = False
-                for unit in player.units:
-                    if unit.x == build.x and unit.y == build.y:
-                        build.build_stacked = True
+                unit = gm.unit_at(build.x, build.y)
+                build.build_stacked = unit is not None and unit.player_id == player.id
             build.draw(game_surface, gm.map_x, gm.map_y)
         for unit in player.units:
             unit.draw(game_surface, gm.map_x, gm.map_y)
@@ -348,7 +374,7 @@ class Typing:
         global gm, ai
         if Typing.typed_string.lower() == 'y':
             gm.ai_id = AI_ID
-            ai = GameAI(gm, render_playing_state)
+            create_ai()
             show_hint(HINTS.LOAD)
             Typing.typed_string = None
         elif Typing.typed_string.lower() == 'n':
@@ -361,12 +387,16 @@ class Typing:
 try:
     gm = GameManager.load()
     if gm.ai_id:
-        ai = GameAI(gm, render_playing_state)
+        create_ai()
     show_hint(HINTS.LOAD)
 except:
     gm = GameManager()
     gm.ai_id = AI_ID
-    ai = GameAI(gm, render_playing_state)
+    create_ai()
+
+# 预热 AI 进程池：进程导入模块并缓存地图，之后每次搜索只传局面
+ai_pool.start()
+ai_pool.set_map(gm.map)
 
 # game_surface边框
 border_rect = pygame.Rect(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
@@ -391,13 +421,8 @@ while True:
                 cur_state = GameState.PLAYING
                 pygame.time.delay(200)
         elif cur_state == GameState.PLAYING:
-            if gm.cur_player_id == gm.ai_id:
-                show_hint(HINTS.AI)
-                ai.play_turn()
-                pygame.event.clear()  # 清除事件列表
-                winners = gm.check_game_over()
-                if winners:
-                    cur_state = GameState.GAME_OVER
+            # AI 回合中只能查看地图（移动、拖动）、帮助、存读档和跳过 AI 回合，AI 的行动在下面每帧推进
+            ai_turn = is_ai_turn()
             # 如果处于输入关卡状态
             if Typing.is_typing():
                 Typing.handle_event(event)
@@ -415,9 +440,17 @@ while True:
                     elif event.key == K_d:
                         gm.map_x = min(gm.map.width - MAP_VIEW_SIZE, gm.map_x + 4)
                 if event.key == K_SPACE:
-                    gm.next_turn()
+                    if not ai_turn:
+                        gm.next_turn()
                 elif event.key == K_h:
                     show_help_string()
+                elif event.key == K_c:
+                    if ai_turn:
+                        ai.cancel()
+                        info_string = list(DEFAULT_INFO_STRING)
+                        winners = gm.check_game_over()
+                        if winners:
+                            cur_state = GameState.GAME_OVER
                 elif event.key == K_F5:
                     gm.save()
                     show_hint(HINTS.SAVE)
@@ -425,13 +458,14 @@ while True:
                     try:
                         gm = GameManager.load()
                         if gm.ai_id:
-                            ai = GameAI(gm, render_playing_state)
+                            create_ai()
                         show_hint(HINTS.LOAD)
                     except FileNotFoundError:
                         print("Game save not found.")
                         show_hint(HINTS.NO_FILE)
                 elif event.key == K_F1:
-                    Typing.enter_typing('level')
+                    if not ai_turn:
+                        Typing.enter_typing('level')
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 mouse_x, mouse_y = pygame.mouse.get_pos()
                 grid_x, grid_y = (mouse_x - start_x - SCREEN_MARGIN) // TILE_SIZE, (mouse_y - start_y - SCREEN_MARGIN) // TILE_SIZE
@@ -439,8 +473,14 @@ while True:
                 if 0 <= grid_x < MAP_VIEW_SIZE and 0 <= grid_y < MAP_VIEW_SIZE:
                     grid_x += gm.map_x
                     grid_y += gm.map_y
+                    # AI 回合：左键只能拖动地图
+                    if ai_turn:
+                        if event.button == 1:
+                            is_dragging = True
+                            drag_start_pos = (mouse_x, mouse_y)
+                            drag_start_map_pos = (gm.map_x, gm.map_y)
                     # 左键
-                    if event.button == 1:
+                    elif event.button == 1:
                         selected = gm.selected_unit
                         # 选择了我方单位
                         if selected and selected.player_id == gm.cur_player_id:
@@ -480,7 +520,7 @@ while True:
                         gm.select_unit(grid_x, grid_y, True)
                         right_click_view_coordinates = (grid_x, grid_y)
                         right_click_view_bool = True
-                if event.button == 2:
+                if event.button == 2 and not ai_turn:
                     gm.next_turn()
             elif event.type == pygame.MOUSEBUTTONUP:
                 if event.button == 1:
@@ -545,6 +585,23 @@ while True:
 
     # endregion Handling Events
 
+    # region AI --------------------------------------------------------  AI ----------------
+    # 搜索在 AI 的后台线程中进行，这里每帧取回已决定的行动并执行，界面保持响应
+    if cur_state == GameState.PLAYING and is_ai_turn() and not Typing.is_typing():
+        if not ai.running:
+            show_hint(HINTS.AI, -1)
+            ai.start_turn()
+        if ai.update():
+            info_string = list(DEFAULT_INFO_STRING)
+            winners = gm.check_game_over()
+            if winners:
+                cur_state = GameState.GAME_OVER
+    # 对手思考时，AI 预先搜索预测的局面
+    elif cur_state in (GameState.PLAYING, GameState.SHOP) and gm.ai_id is not None and ai:
+        ai.ponder()
+
+    # endregion AI
+
     # region Rendering -------------------------------------------------  Rendering ----------------
 
     if cur_state == GameState.MENU:
@@ -0,0 +1,114 @@
+"""
+整回合规划：对 AI 一回合里全军的攻击做束搜索（beam search），决定攻击的组合和单位的先后顺序
+- 计划是按顺序执行的攻击行动列表（actions.py 的 int 表示，含移动到出发格），每一步为某个单位加一次攻击
+    - 任何前缀本身也是一个计划：计划之外的单位（和只移动的行动）仍由 GameAI 逐个搜索
+- 所有计划共用一个 SearchState：展开计划时从回合开始执行它的行动，评估子计划后撤销，评估是 O(1) 的
+- 每一步保留分数最高的 beam_width 个计划；到达同一局面（哈希相同）的计划只保留一个，
+  攻击相同、只是顺序不同的计划不会重复展开
+- 候选计划最后扣除对手下回合对计划中已行动单位的反击估计（这些单位的位置已经固定），按扣除后的分数选出最佳计划
+- 单步的分数和反击都按期望幸运值计算；实际执行时运气不同导致计划中的行动不再合法，则改为逐个单位搜索
+- 第一步的候选攻击可以分给多个工作进程（first_actions），各自束搜索后由 GameAI 合并
+"""
+from actions import ACTION_ATTACK, KIND_MASK
+from units import TypeTable
+from search import DEAD
+from snapshot import ATTACKED
+import time
+
+BEAM_WIDTH = 16
+
+
+def plan_turn(state, roots, player_id, enemy_id, beam_width=BEAM_WIDTH, time_limit=None, first_actions=None):
+    """
+    对 roots（state 中的单位编号，顺序决定同分时的优先级）规划本回合的攻击
+    - time_limit: 毫秒，None 表示不限时；到时停止展开，用已经得到的计划
+    - first_actions: 第一步只考虑这些攻击（并行时每个进程一组），None 表示全部
+    返回 (分数, [行动, ...])；state 在返回时恢复原状
+    """
+    deadline = None if time_limit is None else time.perf_counter() + time_limit / 1000
+    mark = state.begin_undo()
+    beam = [(state.evaluate(player_id, enemy_id), ())]
+    candidates = list(beam) if first_actions is None else []
+    seen = {state.hash}
+    while beam and (deadline is None or time.perf_counter() < deadline):
+        children = []
+        for _, plan in beam:
+            if children and deadline is not None and time.perf_counter() >= deadline:
+                break
+            for action in plan:
+                state.execute(action)
+            plan_mark = state.begin_undo()
+            for root in roots:
+                if state.flags[root] & (DEAD | ATTACKED):
+                    continue  # actions() 不检查是否已经攻击过
+                for action in state.actions(root):
+                    if action & KIND_MASK != ACTION_ATTACK:
+                        continue
+                    if not plan and first_actions is not None and action not in first_actions:
+                        continue
+                    state.execute(action)
+                    if state.hash not in seen:
+                        seen.add(state.hash)
+                        children.append((state.evaluate(player_id, enemy_id), plan + (action,)))
+                    state.undo(plan_mark)
+            state.undo(mark)
+        # 稳定排序：同分时保留先生成的（单位顺序靠前的）计划
+        children.sort(key=lambda child: -child[0])
+        beam = children[:beam_width]
+        candidates.extend(beam)
+
+    best = None
+    candidates.sort(key=lambda candidate: -candidate[0])
+    for score, plan in candidates:
+        if best is not None and deadline is not None and time.perf_counter() >= deadline:
+            break
+        if best is not None and score <= best[0]:
+            break  # 反击只会减分，之后的计划不可能更好
+        committed = {state.actor_of(action) for action in plan}
+        for action in plan:
+            state.execute(action)
+        score -= retaliation(state, committed, player_id, enemy_id)
+        state.undo(mark)
+        if best is None or score > best[0]:
+            best = (score, list(plan))
+    return best if best is not None else (float('-inf'), [])
+
+
+def retaliation(state, committed, player_id, enemy_id):
+    """
+    对手下回合对 committed（计划中已行动的单位编号）的反击估计（与 evaluate 同一量纲）
+    - 对手的每个单位各自选一次期望收益最大的攻击（attack_value，不计反击，单位之间不互相阻挡）
+    - 同一目标受到的损失不超过它现有的价值
+    """
+    mark = state.begin_undo()
+    if state.cur_player_id != enemy_id:
+        state.next_turn()
+    loss = {}
+    for source in state.units_of(enemy_id) + state.builds_of(enemy_id):
+        best_target, best_value = None, 0
+        for action in state.actions(source):
+            if action & KIND_MASK != ACTION_ATTACK:
+                continue
+            target = state.target_of(action)
+            if target in committed and state.owner[target] == player_id:
+                value = state.attack_value(source, target)
+                if value > best_value:
+                    best_target, best_value = target, value
+        if best_target is not None:
+            loss[best_target] = loss.get(best_target, 0) + best_value
+    total = 0
+    for target, value in loss.items():
+        kind = state.kind[target]
+        total += min(value, state.health[target] / TypeTable.max_health[kind] * TypeTable.price[kind])
+    state.undo(mark)
+    return total
+
+
+def plan_task(state, roots, player_id, enemy_id, beam_width=BEAM_WIDTH, time_limit=None, first_actions=None,
+              table=None):
+    """工作进程的入口（与 search_task 的调用方式一致，table 不使用）"""
+    start = time.perf_counter()
+    score, plan = plan_turn(state, roots, player_id, enemy_id, beam_width, time_limit,
+                            None if first_actions is None else set(first_actions))
+    print(f'整回合规划：{len(plan)} 次攻击，分数 {score:.1f}，用时 {(time.perf_counter() - start) * 1000:.0f} ms')
+    return score, plan
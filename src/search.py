@@ -0,0 +1,564 @@
+"""
+AI 搜索专用的局面表示：结构数组（struct of arrays），和界面用的 GameManager 分开
+- 每个单位 / 建筑是一个下标，属性存在平行的 array 里；阵亡只打标记，下标在整个搜索中不变
+- 地图和类型属性是共享的只读数据（GameMap 编译出的数组、TypeTable 的各列）
+- 规则与 GameManager 的模拟模式（is_simulation=True）一致
+- 伤害默认用期望幸运值（luck = EXPECTED_LUCK），同一局面总是得到同样的分数，置换表等缓存才有意义；
+  luck 设为 None 时从 rng 随机抽取（消耗顺序与 GameManager 一致），用于对照；
+  from_game 得到的局面的 rng 是 gm.rng 的副本，抽到的幸运值与 GameManager 接下来抽到的相同，且不推进 gm.rng
+- 和 GameManager 之间通过局面快照（snapshot.py）无损互相转换
+- 行动用 actions.py 的 int 表示，只记录格子，不依赖对象编号
+- 修改都记入撤销日志，minimax 用 begin_undo / undo 回溯
+- hash 是局面的 Zobrist 哈希（见 zobrist.py），随每次修改增量更新
+- 评估用的合计（各玩家单位价值之和、建筑数）也随修改增量更新，evaluate 是 O(1) 的；
+  合计是整数（单位价值取定点数），任何执行 / 撤销顺序下都与从头计算（compute_evaluation）逐位相同
+"""
+from const import *
+from units import TypeTable, TypeFlag, Build
+from zobrist import ZobristTable, FLAG_STATES
+from actions import ACTION_MOVE, ACTION_ATTACK, KIND_MASK, ACTOR_BUILD, TARGET_BUILD, UNIT_SHIFT, TO_SHIFT, \
+    TARGET_SHIFT, TILE_MASK, pack_action
+from snapshot import MAGIC, HEADER, RECORD, MOVED, ATTACKED, STACKED, PLAYER_ORDER, encode_state, decode_state
+from array import array
+import heapq
+import math
+import random
+
+DEAD = 8  # 状态位：已阵亡（快照里不会出现）
+EXPECTED_LUCK = 4.5  # 幸运值 0 ~ 9 的期望
+
+UNDO_OBJECT = 0
+UNDO_TURN = 1
+UNDO_TOTALS = 2  # 哈希和评估合计
+
+VALUE_SCALE = 1000000  # 单位价值的定点数倍数：合计用整数累加，读取时才除
+
+
+class SearchState:
+    def __init__(self, game_map):
+        self.map = game_map
+        self.width = game_map.width
+        self.height = game_map.height
+        # 平行数组，下标即对象编号；单位在前、建筑在后，各自按玩家 0, 1, 中立 的列表顺序排列
+        self.kind = array('H')     # 类型 id
+        self.owner = array('b')    # player_id，中立为 -1
+        self.tile = array('i')     # 扁平坐标 y * width + x
+        self.health = array('d')
+        self.flags = array('B')    # MOVED / ATTACKED / STACKED / DEAD
+        self.order = array('i')    # 在所属玩家列表中的先后（占领后排到新主人的最后）
+        self.next_order = 0
+        # 单位不会易主，按玩家分好编号；建筑可能被占领，只记录编号
+        self.unit_ids = {0: [], 1: [], -1: []}
+        self.build_ids = []
+        # 格子 -> 对象编号，-1 表示空
+        tile_count = self.width * self.height
+        self.unit_grid = array('i', [-1]) * tile_count
+        self.build_grid = array('i', [-1]) * tile_count
+        self.money = array('i', [0, 0, 0])  # 按 player_id 取，-1 正好对应最后一个（中立）
+        self.turn = 1
+        self.cur_player_id = 0
+        self.ai_id = None
+        self.luck = EXPECTED_LUCK  # 伤害用的幸运值，None 表示随机抽取
+        self.rng = random  # luck 为 None 时抽取幸运值的随机数发生器（from_game 时为 gm.rng 的副本）
+        self.log = []  # 撤销日志
+        self.zobrist = ZobristTable.for_size(tile_count)
+        self.hash = self.compute_hash()
+        # 评估用的合计，按 player_id 取；单位价值 = round(血量 / 最大血量 * 价格 * VALUE_SCALE)
+        self.unit_value = array('q', [0, 0, 0])
+        self.build_count = array('i', [0, 0, 0])
+
+    # region Conversion
+    @classmethod
+    def from_snapshot(cls, buffer, game_map):
+        """从快照（bytes / memoryview / 共享内存）创建，不保留对 buffer 的引用"""
+        (_, _, turn, cur_player_id, ai_id, *rest) = HEADER.unpack_from(buffer, 0)
+        money, unit_counts, build_counts = rest[0:3], rest[3:6], rest[6:9]
+        state = cls(game_map)
+        state.turn = turn
+        state.cur_player_id = cur_player_id
+        state.ai_id = None if ai_id == -1 else ai_id
+        for player_id, player_money in zip(PLAYER_ORDER, money):
+            state.money[player_id] = player_money
+        offset = HEADER.size
+        for counts in (unit_counts, build_counts):
+            for player_id, count in zip(PLAYER_ORDER, counts):
+                for _ in range(count):
+                    type_id, x, y, health, flags = RECORD.unpack_from(buffer, offset)
+                    offset += RECORD.size
+                    state._append(type_id, player_id, y * state.width + x, health, flags)
+        state.hash = state.compute_hash()
+        return state
+
+    @classmethod
+    def from_game(cls, gm):
+        state = cls.from_snapshot(encode_state(gm), gm.map)
+        state.rng = random.Random()
+        state.rng.setstate(gm.rng.getstate())
+        return state
+
+    def _append(self, type_id, player_id, tile, health, flags):
+        index = len(self.kind)
+        self.kind.append(type_id)
+        self.owner.append(player_id)
+        self.tile.append(tile)
+        self.health.append(health)
+        self.flags.append(flags)
+        self.order.append(self.next_order)
+        self.next_order += 1
+        self._account(index, 1)
+        if type_id >= TypeTable.unit_count:
+            self.build_grid[tile] = index
+            self.build_ids.append(index)
+        else:
+            self.unit_grid[tile] = index
+            self.unit_ids[player_id].append(index)
+        return index
+
+    def to_snapshot(self, map_id=0):
+        """编码为与 encode_state 相同格式的快照"""
+        width = self.width
+        players = [[self.objects_of(player_id, builds) for player_id in PLAYER_ORDER] for builds in (False, True)]
+        buffer = bytearray(HEADER.size + RECORD.size * sum(len(objs) for group in players for objs in group))
+        HEADER.pack_into(buffer, 0, MAGIC, map_id, self.turn, self.cur_player_id,
+                         -1 if self.ai_id is None else self.ai_id,
+                         *(self.money[player_id] for player_id in PLAYER_ORDER),
+                         *(len(objs) for objs in players[0]), *(len(objs) for objs in players[1]))
+        offset = HEADER.size
+        for group in players:
+            for objs in group:
+                for index in objs:
+                    y, x = divmod(self.tile[index], width)
+                    RECORD.pack_into(buffer, offset, self.kind[index], x, y, self.health[index],
+                                     self.flags[index] & (MOVED | ATTACKED | STACKED))
+                    offset += RECORD.size
+        return bytes(buffer)
+
+    def compact(self, indices):
+        """
+        去掉阵亡的对象，返回 (局面, indices 在该局面中的编号)，与工作进程从 to_snapshot 恢复出的局面一致
+        - 快照不含阵亡的对象，之后的编号都会前移，按所在格重新查找；没有阵亡的对象时原样返回
+        """
+        if not any(flags & DEAD for flags in self.flags):
+            return self, indices
+        state = SearchState.from_snapshot(self.to_snapshot(), self.map)
+        state.luck, state.rng = self.luck, self.rng
+        return state, [(state.build_grid if self.is_build(index) else state.unit_grid)[self.tile[index]]
+                       for index in indices]
+
+    def to_game(self, level=None):
+        """还原为 GameManager（单位和建筑的列表顺序与原局面一致）"""
+        return decode_state(self.to_snapshot(), self.map, level)
+
+    def index_of(self, obj):
+        """GameManager 中的单位 / 建筑在本局面中的编号"""
+        tile = obj.y * self.width + obj.x
+        return self.build_grid[tile] if isinstance(obj, Build) else self.unit_grid[tile]
+
+    # endregion Conversion
+
+    # region Query
+    def is_build(self, index):
+        return self.kind[index] >= TypeTable.unit_count
+
+    def objects_of(self, player_id, builds=False):
+        """玩家的单位（或建筑）编号，顺序与 GameManager 中的列表一致"""
+        return self.builds_of(player_id) if builds else self.units_of(player_id)
+
+    def actor_of(self, action):
+        """行动（见 actions.py）的行动者编号"""
+        grid = self.build_grid if action & ACTOR_BUILD else self.unit_grid
+        return grid[action >> UNIT_SHIFT & TILE_MASK]
+
+    def target_of(self, action):
+        """攻击行动的目标编号"""
+        grid = self.build_grid if action & TARGET_BUILD else self.unit_grid
+        return grid[action >> TARGET_SHIFT & TILE_MASK]
+
+    def units_of(self, player_id):
+        flags = self.flags
+        return [index for index in self.unit_ids[player_id] if not flags[index] & DEAD]
+
+    def builds_of(self, player_id):
+        flags, owner = self.flags, self.owner
+        result = [index for index in self.build_ids if owner[index] == player_id and not flags[index] & DEAD]
+        result.sort(key=self.order.__getitem__)
+        return result
+
+    def _object_key(self, index):
+        if self.flags[index] & DEAD:
+            return 0
+        return self.zobrist.object_key(self.kind[index], self.owner[index], self.tile[index],
+                                       self.health[index], self.flags[index])
+
+    def compute_hash(self):
+        """从头计算 Zobrist 哈希（与 GameManager.position_hash 相同），用于初始化和校验"""
+        zobrist = self.zobrist
+        result = zobrist.side_key(self.cur_player_id)
+        for player_id in PLAYER_ORDER:
+            result ^= zobrist.money_key(player_id, self.money[player_id])
+        for index in range(len(self.kind)):
+            result ^= self._object_key(index)
+        return result
+
+    def has_units(self, player_id):
+        flags = self.flags
+        return any(not flags[index] & DEAD for index in self.unit_ids[player_id])
+
+    def check_game_over(self):
+        """与 GameManager.check_game_over 相同：有玩家没有单位时返回还有单位的玩家列表，否则返回 None"""
+        winners = [player_id for player_id in (0, 1) if self.has_units(player_id)]
+        return winners if len(winners) < 2 else None
+
+    def _account(self, index, sign):
+        """把对象计入（sign=1）或移出（sign=-1）评估用的合计，阵亡的对象不计"""
+        if self.flags[index] & DEAD:
+            return
+        type_id, owner = self.kind[index], self.owner[index]
+        if type_id >= TypeTable.unit_count:
+            self.build_count[owner] += sign
+        else:
+            self.unit_value[owner] += sign * self._unit_value(index)
+
+    def _unit_value(self, index):
+        """单位价值的定点数：血量 / 最大血量 * 价格，乘 VALUE_SCALE 后取整"""
+        type_id = self.kind[index]
+        return round(self.health[index] / TypeTable.max_health[type_id] * TypeTable.price[type_id] * VALUE_SCALE)
+
+    def evaluate(self, player_id, enemy_id):
+        """
+        局面评估（公式见 compute_evaluation），读取增量维护的合计，O(1)
+        合计是整数，结果与 compute_evaluation 逐位相同，同分行动的先后不受执行 / 撤销历史影响
+        以后增加的局面评估项也应当做成整数合计，在 _account 中维护
+        """
+        score = (self.unit_value[player_id] - self.unit_value[enemy_id]) / VALUE_SCALE
+        score += (5 * self.build_count[player_id] - 5 * self.build_count[enemy_id]) * 10
+        score += (self.money[player_id] - self.money[enemy_id]) * 0.5
+        return score
+
+    def compute_evaluation(self, player_id, enemy_id):
+        """从头计算评估分数，用于校验：双方单位价值（血量比例 × 价格）之差 + 建筑数之差 × 50 + 金钱之差 × 0.5"""
+        my_unit_value = sum(self._unit_value(index) for index in self.units_of(player_id))
+        enemy_unit_value = sum(self._unit_value(index) for index in self.units_of(enemy_id))
+        score = (my_unit_value - enemy_unit_value) / VALUE_SCALE
+        owner, flags = self.owner, self.flags
+        my_build_value = 5 * sum(1 for index in self.build_ids if owner[index] == player_id and not flags[index] & DEAD)
+        enemy_build_value = 5 * sum(1 for index in self.build_ids if owner[index] == enemy_id and not flags[index] & DEAD)
+        score += (my_build_value - enemy_build_value) * 10
+        score += (self.money[player_id] - self.money[enemy_id]) * 0.5
+        return score
+    # endregion Query
+
+    # region Move Generation
+    def actions(self, index):
+        """
+        单位所有可能的行动（actions.py 的 int 表示），相当于 get_all_possible_actions：攻击在前，移动在后，顺序与 GameManager 一致
+        """
+        type_id = self.kind[index]
+        flags = self.flags[index]
+        skip_move = bool(flags & MOVED)
+        attack_without_move = TypeTable.min_range[type_id] > 1
+        override_movement = 1 if TypeTable.flags[type_id] & TypeFlag.BLITZ and flags & ATTACKED else None
+        movement = override_movement if override_movement else TypeTable.movement[type_id]
+        width = self.width
+        start = self.tile[index]
+
+        possible_moves = set()
+        if not skip_move:
+            for tile in self._search_reachable(index, movement):
+                if tile != start:
+                    possible_moves.add((tile % width, tile // width))
+        actions = []
+        if not override_movement:
+            actions = self._attack_actions(index, start if attack_without_move else None, possible_moves, movement)
+        is_build = type_id >= TypeTable.unit_count
+        actions.extend(pack_action(ACTION_MOVE, start, y * width + x, 0, is_build) for x, y in set(possible_moves))
+        return actions
+
+    def _search_reachable(self, index, movement):
+        """与 GameManager._search_reachable 相同的 Dijkstra，占用情况直接查格子数组"""
+        width, height = self.width, self.height
+        cost_grid = self.map.move_cost[TypeTable.move_type[self.kind[index]]]
+        player_id = self.owner[index]
+        unit_grid, build_grid, kind, owner = self.unit_grid, self.build_grid, self.kind, self.owner
+        type_flags = TypeTable.flags
+        start = self.tile[index]
+        heap = [(-movement, start)]
+        best_remain = {start: movement}
+        settled = set()
+        while heap:
+            neg_remain, tile = heapq.heappop(heap)
+            if tile in settled:
+                continue
+            settled.add(tile)
+            remain_movement = -neg_remain
+            if remain_movement <= 0:
+                continue
+            y, x = divmod(tile, width)
+            for neighbor, inside in ((tile + width, y + 1 < height), (tile + 1, x + 1 < width),
+                                     (tile - width, y > 0), (tile - 1, x > 0)):
+                if not inside or neighbor in settled or unit_grid[neighbor] >= 0:
+                    continue
+                build = build_grid[neighbor]
+                if build >= 0 and not (type_flags[kind[build]] & TypeFlag.STACKABLE and owner[build] == player_id):
+                    continue
+                cost = cost_grid[neighbor]
+                if cost < 0:
+                    continue
+                new_remain = remain_movement - cost
+                if new_remain > best_remain.get(neighbor, -0.1):
+                    best_remain[neighbor] = new_remain
+                    heapq.heappush(heap, (-new_remain, neighbor))
+        return settled
+
+    def _attack_actions(self, index, only_from, possible_moves, movement):
+        """
+        攻击行动：按目标格下标从小到大，每个目标再按 GameManager.tiles_in_range 的顺序找出发点
+        only_from 不为 None 时只能原地攻击
+        """
+        type_id = self.kind[index]
+        min_range, max_range = TypeTable.min_range[type_id], TypeTable.max_range[type_id]
+        if max_range <= 0:
+            return []
+        width, height = self.width, self.height
+        start = self.tile[index]
+        player_id = self.owner[index]
+        if only_from is not None:
+            move_tiles = {only_from}
+            reach = 0
+        else:
+            move_tiles = {start}
+            move_tiles.update(y * width + x for x, y in possible_moves)
+            reach = self.map.max_steps(TypeTable.move_type[type_id], movement) if possible_moves else 0
+        sx, sy = start % width, start // width
+        is_build = type_id >= TypeTable.unit_count
+        # 敌方（含中立）占用的格子，距离明显够不到的直接跳过
+        targets = set()
+        for other in range(len(self.kind)):
+            if self.owner[other] != player_id and not self.flags[other] & DEAD:
+                tile = self.tile[other]
+                if abs(tile % width - sx) + abs(tile // width - sy) <= reach + max_range:
+                    targets.add(tile)
+        actions = []
+        for target_tile in sorted(targets):
+            tx, ty = target_tile % width, target_tile // width
+            enemies = [other for other in (self.unit_grid[target_tile], self.build_grid[target_tile])
+                       if other >= 0 and self.owner[other] != player_id]
+            for dy in range(-max_range, max_range + 1):
+                my = ty + dy
+                if not 0 <= my < height:
+                    continue
+                rest = max_range - abs(dy)
+                for dx in range(-rest, rest + 1):
+                    mx = tx + dx
+                    if abs(dx) + abs(dy) < min_range or not 0 <= mx < width:
+                        continue
+                    move_tile = my * width + mx
+                    if move_tile not in move_tiles:
+                        continue
+                    for enemy in enemies:  # 优先选择单位作为目标
+                        if self._can_attack(index, enemy, move_tile):
+                            actions.append(pack_action(ACTION_ATTACK, start, move_tile, target_tile, is_build,
+                                                       self.kind[enemy] >= TypeTable.unit_count))
+                            break
+        return actions
+
+    def _can_attack(self, source, target, source_tile, check_distance=False):
+        """与 GameManager._can_attack 相同；source_tile 是假设移动到的位置"""
+        source_type, target_type = self.kind[source], self.kind[target]
+        if check_distance:
+            width = self.width
+            a, b = self.tile[source], self.tile[target]
+            distance = abs(a % width - b % width) + abs(a // width - b // width)
+            if distance < TypeTable.min_range[source_type] or distance > TypeTable.max_range[source_type]:
+                return False
+        source_move_type = TypeTable.move_type[source_type]
+        if target_type >= TypeTable.unit_count:
+            if self.flags[target] & STACKED:
+                return False
+            elif source_move_type == MoveType.Feet and self.tile[source] != source_tile:
+                return False
+        else:
+            if source_move_type < 3 and self.map.tiles[source_tile] == Terrain.WATER:
+                return False
+            if not TypeTable.can_attack[source_type * TypeTable.type_count + target_type]:
+                return False
+        return True
+    # endregion Move Generation
+
+    # region Execution
+    def _save(self, index):
+        self.log.append((UNDO_OBJECT, index, self.tile[index], self.health[index], self.flags[index],
+                         self.owner[index], self.order[index]))
+
+    def _place(self, index, tile):
+        grid = self.build_grid if self.kind[index] >= TypeTable.unit_count else self.unit_grid
+        if grid[self.tile[index]] == index:
+            grid[self.tile[index]] = -1
+        self.tile[index] = tile
+        grid[tile] = index
+
+    def _die(self, index):
+        grid = self.build_grid if self.kind[index] >= TypeTable.unit_count else self.unit_grid
+        grid[self.tile[index]] = -1
+        self.flags[index] |= DEAD
+
+    def execute(self, action):
+        """执行 actions() 给出的行动（模拟模式：不播放音效、移动后不强制结束）"""
+        self.log.append((UNDO_TOTALS, self.hash, self.unit_value[:], self.build_count[:]))
+        index = self.actor_of(action)
+        to_tile = action >> TO_SHIFT & TILE_MASK
+        # 行动只会改变行动者和目标，先从哈希和评估合计中去掉它们，执行完再加回
+        target = self.target_of(action) if action & KIND_MASK == ACTION_ATTACK else index
+        touched = self._object_key(index) ^ (self._object_key(target) if target != index else 0)
+        self._account(index, -1)
+        if target != index:
+            self._account(target, -1)
+        if action & KIND_MASK == ACTION_MOVE:
+            self._move(index, to_tile)
+        else:
+            if to_tile != self.tile[index]:
+                self._move(index, to_tile)
+            self._attack(index, target)
+        touched ^= self._object_key(index) ^ (self._object_key(target) if target != index else 0)
+        self.hash ^= touched
+        self._account(index, 1)
+        if target != index:
+            self._account(target, 1)
+
+    def settle(self, index):
+        """
+        与 GameManager 实际操作（非模拟）一致：移动后没有攻击目标的单位直接标记为已攻击
+        - 搜索中不需要（这样的单位反正没有攻击行动），用于让预测的局面与实际局面的哈希相同（见 GameAI.ponder）
+        """
+        flags = self.flags[index]
+        if flags & MOVED and not flags & (ATTACKED | DEAD) and not self.actions(index):
+            self.log.append((UNDO_TOTALS, self.hash, self.unit_value[:], self.build_count[:]))
+            self._save(index)
+            self.hash ^= self._object_key(index)
+            self.flags[index] |= ATTACKED
+            self.hash ^= self._object_key(index)
+
+    def _move(self, index, tile):
+        self._save(index)
+        self._place(index, tile)
+        self.flags[index] |= MOVED
+        # 远程兵种移动后不能攻击
+        if TypeTable.min_range[self.kind[index]] > 1:
+            self.flags[index] |= ATTACKED
+
+    def _attack(self, source, target):
+        self._save(source)
+        self._save(target)
+        flags = self.flags
+        flags[source] |= ATTACKED
+        source_type, target_type = self.kind[source], self.kind[target]
+        # 占领：敌方建筑变成中立，中立建筑变成我方
+        if target_type >= TypeTable.unit_count and TypeTable.flags[target_type] & TypeFlag.CAPTURABLE and \
+                TypeTable.move_type[source_type] == MoveType.Feet and self.owner[target] != self.owner[source]:
+            self.owner[target] = -1 if self.owner[target] >= 0 else self.owner[source]
+            self.order[target] = self.next_order
+            self.next_order += 1
+            flags[source] |= MOVED
+            return
+        self.health[target] -= self.damage(source, target)
+        if self.health[target] <= 0:
+            self._die(target)
+        elif self._can_attack(target, source, self.tile[target], True):  # 反击
+            self.health[source] -= self.damage(target, source)
+            if self.health[source] <= 0:
+                self._die(source)
+        if TypeTable.flags[source_type] & TypeFlag.BLITZ:
+            flags[source] &= ~MOVED  # 攻击后还能移动 1 格
+        else:
+            flags[source] |= MOVED
+
+    def attack_value(self, source, target):
+        """
+        走法排序用：攻击的预期收益，与 evaluate 同一量纲，不消耗随机数
+        - 占领：一个建筑的分值；其余：按期望幸运值估计伤害，折算成目标损失的价值（不计反击）
+        """
+        source_type, target_type = self.kind[source], self.kind[target]
+        if target_type >= TypeTable.unit_count and TypeTable.flags[target_type] & TypeFlag.CAPTURABLE and \
+                TypeTable.move_type[source_type] == MoveType.Feet:
+            return 50
+        damage = min(self.damage(source, target, EXPECTED_LUCK), self.health[target])
+        return damage / TypeTable.max_health[target_type] * TypeTable.price[target_type]
+
+    def damage(self, source, target, luck=None):
+        """
+        与 GameManager._calculate_damage 相同的公式
+        luck 默认取 self.luck（期望幸运值）；self.luck 为 None 时和 GameManager 一样从 rng 随机取 0 ~ 9
+        """
+        source_type, target_type = self.kind[source], self.kind[target]
+        health_percentage = math.ceil(self.health[source] / TypeTable.max_health[source_type] * 10) / 10
+        if luck is None:
+            luck = self.luck if self.luck is not None else self.rng.randint(0, 9)
+        pair = source_type * TypeTable.type_count + target_type
+        terrain = self.map.tiles[self.tile[target]]
+        return health_percentage * (TypeTable.attack[source_type] + luck) * \
+            TypeTable.terrain_damage[pair * TypeTable.terrain_count + terrain] * TypeTable.global_damage[pair]
+
+    def _retag(self, indices, player_id, set_bits, clear_bits, is_build):
+        """
+        把 indices 中属于 player_id 的对象的状态位改为 (flags | set_bits) & ~clear_bits
+        indices 须全是单位或全是建筑（is_build），哈希中只替换状态位那一部分
+        """
+        flags, owner, tile = self.flags, self.owner, self.tile
+        keys = self.zobrist.flags
+        layer = is_build * self.zobrist.tile_count
+        result = self.hash
+        for index in indices:
+            old = flags[index]
+            new = (old | set_bits) & ~clear_bits
+            if old != new and owner[index] == player_id:
+                flags[index] = new
+                if not old & DEAD:
+                    offset = (layer + tile[index]) * FLAG_STATES
+                    result ^= keys[offset + (old & 7)] ^ keys[offset + (new & 7)]
+        self.hash = result
+
+    def next_turn(self):
+        self.log.append((UNDO_TURN, self.cur_player_id, self.turn, array('i', self.money), array('B', self.flags),
+                         self.hash))
+        flags, owner, kind = self.flags, self.owner, self.kind
+        zobrist = self.zobrist
+        player_id = self.cur_player_id
+        self._retag(self.unit_ids[player_id], player_id, MOVED | ATTACKED, 0, False)
+        self._retag(self.build_ids, player_id, ATTACKED, 0, True)
+        self.hash ^= zobrist.side_key(player_id)
+        self.cur_player_id = player_id = (player_id + 1) % 2
+        self.hash ^= zobrist.side_key(player_id)
+        if player_id == 0:
+            self.turn += 1
+        self._retag(self.unit_ids[player_id], player_id, 0, MOVED | ATTACKED, False)
+        self._retag(self.build_ids, player_id, 0, ATTACKED, True)
+        income = TypeTable.income
+        money = self.money[player_id]
+        for index in self.build_ids:
+            if owner[index] == player_id and not flags[index] & DEAD:
+                self.money[player_id] += income[kind[index]]
+        self.hash ^= zobrist.money_key(player_id, money) ^ zobrist.money_key(player_id, self.money[player_id])
+
+    def begin_undo(self):
+        """返回标记，undo(mark) 撤销之后的所有修改"""
+        return len(self.log)
+
+    def undo(self, mark):
+        log = self.log
+        unit_count = TypeTable.unit_count
+        while len(log) > mark:
+            entry = log.pop()
+            if entry[0] == UNDO_OBJECT:
+                _, index, tile, health, flags, owner, order = entry
+                grid = self.build_grid if self.kind[index] >= unit_count else self.unit_grid
+                if not self.flags[index] & DEAD and grid[self.tile[index]] == index:
+                    grid[self.tile[index]] = -1
+                self.tile[index], self.health[index], self.flags[index] = tile, health, flags
+                self.owner[index], self.order[index] = owner, order
+                if not flags & DEAD:
+                    grid[tile] = index
+            elif entry[0] == UNDO_TURN:
+                _, self.cur_player_id, self.turn, self.money[:], self.flags[:], self.hash = entry
+            else:
+                _, self.hash, self.unit_value[:], self.build_count[:] = entry
+    # endregion Undo
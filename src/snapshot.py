@@ -0,0 +1,98 @@
+"""
+局面快照：把 GameManager 中搜索需要的状态编码成紧凑的二进制数据
+- 地图不在快照里，只记录 map_id，由接收方用已缓存的同一张地图恢复
+- 布局（小端）：头部 + 各玩家的单位记录 + 各玩家的建筑记录
+    - 头部：魔数、map_id、回合、当前玩家、AI 玩家、三个玩家（0, 1, 中立）的金钱、单位数、建筑数
+    - 记录：类型 id、x、y、血量、状态位（已移动 / 已攻击 / 建筑已叠加）
+- 列表顺序原样保留，恢复后的遍历顺序和原局面一致
+"""
+from units import Unit, Build, TypeTable
+from game import GameManager
+import struct
+
+MAGIC = b'TWS1'
+HEADER = struct.Struct('<4sIibb3i3H3H')
+RECORD = struct.Struct('<Hhhdb')
+
+MOVED = 1
+ATTACKED = 2
+STACKED = 4
+
+PLAYER_ORDER = (0, 1, -1)  # 记录中玩家的先后顺序
+
+
+def snapshot_size(gm):
+    count = sum(len(player.units) + len(player.builds) for player in gm.players + [gm.neutral_player])
+    return HEADER.size + count * RECORD.size
+
+
+def encode_state(gm, map_id=0):
+    """把局面编码为 bytes"""
+    players = [gm.get_player(player_id) for player_id in PLAYER_ORDER]
+    buffer = bytearray(snapshot_size(gm))
+    HEADER.pack_into(buffer, 0, MAGIC, map_id, gm.turn, gm.cur_player_id,
+                     -1 if gm.ai_id is None else gm.ai_id,
+                     *(player.money for player in players),
+                     *(len(player.units) for player in players),
+                     *(len(player.builds) for player in players))
+    offset = HEADER.size
+    for player in players:
+        for unit in player.units:
+            RECORD.pack_into(buffer, offset, unit.type_id, unit.x, unit.y, unit.health,
+                             unit.moved * MOVED | unit.attacked * ATTACKED)
+            offset += RECORD.size
+    for player in players:
+        for build in player.builds:
+            RECORD.pack_into(buffer, offset, build.type_id, build.x, build.y, build.health,
+                             build.moved * MOVED | build.attacked * ATTACKED | build.build_stacked * STACKED)
+            offset += RECORD.size
+    return bytes(buffer)
+
+
+def read_header(buffer):
+    """返回 (map_id, 快照总长度)，魔数不对时抛出 ValueError"""
+    header = HEADER.unpack_from(buffer, 0)
+    if header[0] != MAGIC:
+        raise ValueError("Not a game state snapshot")
+    count = sum(header[8:14])
+    return header[1], HEADER.size + count * RECORD.size
+
+
+def decode_state(buffer, game_map, level=None):
+    """
+    从快照恢复 GameManager
+    - buffer：bytes、bytearray 或 memoryview（如共享内存），只读不写，也不保留对它的引用
+    - game_map：快照对应的地图
+    """
+    (_, _, turn, cur_player_id, ai_id, *rest) = HEADER.unpack_from(buffer, 0)
+    money, unit_counts, build_counts = rest[0:3], rest[3:6], rest[6:9]
+    gm = GameManager.empty(game_map, level)
+    gm.turn = turn
+    gm.cur_player_id = cur_player_id
+    gm.ai_id = None if ai_id == -1 else ai_id
+    kinds = TypeTable.kinds
+    offset = HEADER.size
+    for player_id, count in zip(PLAYER_ORDER, unit_counts):
+        player = gm.get_player(player_id)
+        for _ in range(count):
+            type_id, x, y, health, flags = RECORD.unpack_from(buffer, offset)
+            offset += RECORD.size
+            unit = Unit.__new__(Unit)
+            unit.kind, unit.x, unit.y, unit.health, unit.player_id = kinds[type_id], x, y, health, player_id
+            unit.moved, unit.attacked = bool(flags & MOVED), bool(flags & ATTACKED)
+            player.units.append(unit)
+            gm._index_add(unit)
+    for player_id, count in zip(PLAYER_ORDER, build_counts):
+        player = gm.get_player(player_id)
+        for _ in range(count):
+            type_id, x, y, health, flags = RECORD.unpack_from(buffer, offset)
+            offset += RECORD.size
+            build = Build.__new__(Build)
+            build.kind, build.x, build.y, build.health, build.player_id = kinds[type_id], x, y, health, player_id
+            build.moved, build.attacked = bool(flags & MOVED), bool(flags & ATTACKED)
+            build.build_stacked = bool(flags & STACKED)
+            player.builds.append(build)
+            gm._index_add(build)
+    for player_id, player_money in zip(PLAYER_ORDER, money):
+        gm.get_player(player_id).money = player_money
+    return gm
@@ -0,0 +1,105 @@
+"""
+置换表：以局面哈希（见 zobrist.py）为键，缓存 minimax 节点的搜索结果
+- 每项记录：键、剩余深度、分数、界的类型、最佳行动、写入时的代数
+    - EXACT：分数即该节点的值；LOWER：值 >= 分数（发生了剪枝）；UPPER：值 <= 分数（没有行动超过 alpha）
+    - 最佳行动是 actions.py 的 int 表示，0 表示没有
+- 容量固定：按字节上限换算成项数（2 的幂），每两项一组，由键的低位选组
+    - 第一项深度优先：新结果不比原有的浅，或原有项是之前的搜索写入的（代数不同）时才替换
+    - 第二项总是替换
+- 每次搜索开始时调用 new_search()：代数加一，统计清零；表的内容保留，同一回合里各单位的搜索可以互相利用
+    - 前提是键相同即局面相同：zobrist.py 哈希的是精确的血量和金钱，evaluate 读取的量都在哈希里
+- 节点的值还和所在层数、评估方、根单位（第 2 层的剪枝条件）有关，这些由 context_key() 混入键中
+"""
+from const import Counter
+from array import array
+import random
+
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+ENTRY_BYTES = 27  # 每项的内存：键、分数、行动各 8 字节，深度 / 界 / 代数各 1 字节
+DEFAULT_BYTES = 8 * 1024 * 1024
+SEED = 0x7AB1E
+
+
+class TranspositionTable:
+    def __init__(self, max_bytes=DEFAULT_BYTES):
+        size = 2
+        while size * 2 * ENTRY_BYTES <= max_bytes:
+            size *= 2
+        self.size = size
+        self.bucket_mask = size // 2 - 1
+        self.keys = array('Q', bytes(8 * size))
+        self.scores = array('d', bytes(8 * size))
+        self.depths = array('b', [-1]) * size  # -1 表示空
+        self.bounds = array('B', bytes(size))
+        self.ages = array('B', bytes(size))
+        self.moves = array('Q', bytes(8 * size))
+        self.age = 0
+        self.contexts = {}  # 节点上下文 -> 随机键
+        self.rng = random.Random(SEED)
+        self.counter = Counter()
+
+    def new_search(self):
+        self.age = (self.age + 1) & 0xFF
+        self.counter.reset()
+
+    def context_key(self, context):
+        """把节点上下文（可哈希的元组）映射为固定的随机键，与局面哈希异或后作为表的键"""
+        key = self.contexts.get(context)
+        if key is None:
+            key = self.contexts[context] = self.rng.getrandbits(64)
+        return key
+
+    def probe(self, key, depth, alpha, beta):
+        """
+        查找剩余深度至少为 depth 的结果
+        - 能直接作为本节点结果时返回 (行动, 分数)，否则返回 None
+        """
+        counter = self.counter
+        counter.increment('probe')
+        slot = (key & self.bucket_mask) * 2
+        for slot in (slot, slot + 1):
+            if self.keys[slot] == key and self.depths[slot] >= 0:
+                break
+        else:
+            return None
+        counter.increment('hit')
+        if self.depths[slot] < depth:
+            return None
+        score, bound = self.scores[slot], self.bounds[slot]
+        if bound == EXACT or (bound == LOWER and score >= beta) or (bound == UPPER and score <= alpha):
+            counter.increment('cutoff')
+            return self.moves[slot] or None, score
+        return None
+
+    def best_move(self, key):
+        """记录的最佳行动，用于走法排序；没有记录时返回 None"""
+        slot = (key & self.bucket_mask) * 2
+        for slot in (slot, slot + 1):
+            if self.keys[slot] == key and self.depths[slot] >= 0:
+                return self.moves[slot] or None
+        return None
+
+    def store(self, key, depth, score, alpha, beta, move):
+        """记录搜索窗口 (alpha, beta) 下得到的分数，界的类型由分数和窗口决定"""
+        if score <= alpha:
+            bound = UPPER
+        elif score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        slot = (key & self.bucket_mask) * 2
+        if not (self.keys[slot] == key or self.depths[slot] <= depth or self.ages[slot] != self.age):
+            slot += 1
+        self.counter.increment('store')
+        self.keys[slot] = key
+        self.depths[slot] = depth
+        self.scores[slot] = score
+        self.bounds[slot] = bound
+        self.ages[slot] = self.age
+        self.moves[slot] = move or 0
+
+    def print(self, title="置换表"):
+        self.counter.print(title)
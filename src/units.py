@@ -1,30 +1,108 @@
 from const import *
-import pygame
+from operator import attrgetter
+from array import array
 import math
 
+
+class UnitType:
+    """
+    单位类型的只读属性记录，同类型的所有单位共享一份（享元）
+    可选特性 anti_air / anti_sub / blitz 统一为 bool
+    """
+    __slots__ = ('id', 'name', 'movement', 'attack_range', 'max_health', 'attack', 'weapon_type', 'armor_type',
+                 'move_type', 'price', 'description', 'anti_air', 'anti_sub', 'blitz')
+
+    def __init__(self, id, name, properties):
+        self._freeze(
+            id=id,
+            name=name,
+            movement=properties['movement'],
+            attack_range=properties['attack_range'],
+            max_health=properties['health'],
+            attack=properties['attack'],
+            weapon_type=properties['weapon_type'],
+            armor_type=properties['armor_type'],
+            move_type=properties['move_type'],
+            price=properties['price'],
+            description=properties['description'],
+            anti_air=properties.get('anti_air', False),
+            anti_sub=properties.get('anti_sub', False),
+            blitz=properties.get('blitz', False),
+        )
+
+    def _freeze(self, **values):
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+
+class BuildType(UnitType):
+    """建筑类型的只读属性记录，建筑不能移动和攻击"""
+    __slots__ = ('shop_type', 'stackable', 'capturable', 'income')
+
+    def __init__(self, id, name, properties):
+        self._freeze(
+            id=id,
+            name=name,
+            movement=0, # 禁用移动
+            weapon_type=0,
+            move_type=-1,
+            price=0,
+            description='',
+            attack_range=(0, 0), # 禁用攻击
+            max_health=100,
+            attack=0,
+            armor_type=1,
+            anti_air=False,
+            anti_sub=False,
+            blitz=False,
+            shop_type=properties['shop_type'],
+            stackable=properties['stackable'],
+            capturable=properties['capturable'],
+            income=properties['income'],
+        )
+
+
 class Unit:
+    """
+    实例只保存可变状态，其余属性通过 kind 读取共享的 UnitType
+    """
+    __slots__ = ('x', 'y', 'health', 'moved', 'attacked', 'player_id', 'kind')
+
     def __init__(self, x, y, type, player_id):
+        self.kind = self.TYPES[type]
         self.x = x
         self.y = y
-        self.type = type
         self.player_id = player_id
         self.moved = False
         self.attacked = False
+        self.health = self.kind.max_health
+
+    type = property(attrgetter('kind.name'))
+    type_id = property(attrgetter('kind.id'))
+    movement = property(attrgetter('kind.movement'))
+    attack_range = property(attrgetter('kind.attack_range'))
+    max_health = property(attrgetter('kind.max_health'))
+    attack = property(attrgetter('kind.attack'))
+    weapon_type = property(attrgetter('kind.weapon_type'))
+    armor_type = property(attrgetter('kind.armor_type'))
+    move_type = property(attrgetter('kind.move_type'))
+    anti_air = property(attrgetter('kind.anti_air'))
+    anti_sub = property(attrgetter('kind.anti_sub'))
+    blitz = property(attrgetter('kind.blitz'))
 
-        if type in self.PROPERTIES:
-            self.movement = self.PROPERTIES[type]['movement']
-            self.attack_range = self.PROPERTIES[type]['attack_range']
-            self.health = self.max_health = self.PROPERTIES[type]['health']
-            self.attack = self.PROPERTIES[type]['attack']
-            self.weapon_type = self.PROPERTIES[type]['weapon_type']
-            self.armor_type = self.PROPERTIES[type]['armor_type']
-            self.move_type = self.PROPERTIES[type]['move_type']
-            if 'anti_air' in self.PROPERTIES[type]:
-                self.anti_air = self.PROPERTIES[type]['anti_air']
-            if 'anti_sub' in self.PROPERTIES[type]:
-                self.anti_sub = self.PROPERTIES[type]['anti_sub']
-            if 'blitz' in self.PROPERTIES[type]:
-                self.blitz = self.PROPERTIES[type]['blitz']
+    def __getstate__(self):
+        # 只序列化可变状态和类型名，深拷贝和存档都走这里
+        return (self.kind.name, self.x, self.y, self.health, self.moved, self.attacked, self.player_id)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):  # 兼容旧存档（实例属性保存在 __dict__ 中）
+            state = (state['type'], state['x'], state['y'], state['health'],
+                     state['moved'], state['attacked'], state['player_id'])
+        name, self.x, self.y, self.health, self.moved, self.attacked, self.player_id = state
+        self.kind = self.TYPES[name]
 
 
     """
@@ -211,25 +289,28 @@ class Unit:
     
 
 class Build(Unit):
+    __slots__ = ('build_stacked',)
+
     def __init__(self, x, y, type, player_id):
-        self.x = x
-        self.y = y
-        self.type = type
-        self.player_id = player_id
+        super().__init__(x, y, type, player_id)
         self.moved = True
-        self.attacked = False
-        self.attack = 0
-        self.movement = 0 # 禁用移动
-        self.attack_range = (0, 0) # 禁用攻击
-        self.health = self.max_health = 100
-        self.armor_type = 1
         self.build_stacked = False
 
-        # read from PROPERTIES
-        self.shop_type = self.PROPERTIES[type]['shop_type']
-        self.stackable = self.PROPERTIES[type]['stackable']
-        self.capturable = self.PROPERTIES[type]['capturable']
-        self.income = self.PROPERTIES[type]['income']
+    shop_type = property(attrgetter('kind.shop_type'))
+    stackable = property(attrgetter('kind.stackable'))
+    capturable = property(attrgetter('kind.capturable'))
+    income = property(attrgetter('kind.income'))
+
+    def __getstate__(self):
+        return super().__getstate__() + (self.build_stacked,)
+
+    def __setstate__(self, state):
+        if isinstance(state, dict):  # 兼容旧存档
+            super().__setstate__(state)
+            self.build_stacked = state['build_stacked']
+            return
+        super().__setstate__(state[:-1])
+        self.build_stacked = state[-1]
 
     """
     if capturable, then it cannot be attacked
@@ -256,9 +337,119 @@ class Build(Unit):
     def draw(self, screen, map_x, map_y):
         super().draw(screen, map_x, map_y)
 
+class TypeFlag:
+    ANTI_AIR = 1
+    ANTI_SUB = 2
+    BLITZ = 4
+    BUILD = 8
+    STACKABLE = 16
+    CAPTURABLE = 32
+
+
+class TypeTable:
+    """
+    所有单位和建筑类型按整数 id 排成的紧凑列表，在导入时由 PROPERTIES 生成
+    - 单位的 id 按 Unit.PROPERTIES 的顺序从 0 开始，建筑的 id 接在单位后面
+    - 地图文件和存档仍然使用类型名，names / ids 负责互相转换
+    - 热点代码直接按 id 读取这些列，例如 TypeTable.price[unit.type_id]
+    - 攻击相关的类型组合预先算成表，下标 pair = 攻击方 id * type_count + 防守方 id：
+        - terrain_damage[pair * terrain_count + 地形]：地形系数 * 兵种克制系数
+        - global_damage[pair]：全局系数（远程 / 近战、飞机打防空、非海军打海军）
+        - can_attack[pair]：只看类型能否攻击（防空、反潜）；与位置有关的条件仍由调用方检查
+      伤害 = 血量百分比 * (攻击力 + 幸运值) * terrain_damage * global_damage，与逐项计算的浮点结果相同
+    """
+    names = []  # id -> 类型名
+    ids = {}    # 类型名 -> id
+    kinds = []  # id -> UnitType / BuildType
+    unit_count = 0  # id 小于它的是单位，其余是建筑
+    price = array('i')
+    attack = array('i')
+    min_range = array('b')
+    max_range = array('b')
+    weapon_type = array('b')
+    armor_type = array('b')
+    move_type = array('b')  # 建筑为 -1
+    movement = array('b')
+    max_health = array('i')
+    income = array('i')  # 单位为 0
+    flags = array('b')  # TypeFlag 的组合
+    type_count = 0
+    terrain_count = 0
+    terrain_damage = array('d')
+    global_damage = array('d')
+    can_attack = array('b')
+
+    @classmethod
+    def compile(cls):
+        """生成 Unit.TYPES / Build.TYPES 和各列（跳过还没有填写属性的占位建筑）"""
+        Unit.TYPES = {}
+        Build.TYPES = {}
+        for name, properties in Unit.PROPERTIES.items():
+            Unit.TYPES[name] = UnitType(len(cls.kinds), name, properties)
+            cls.kinds.append(Unit.TYPES[name])
+        cls.unit_count = len(cls.kinds)
+        for name, properties in Build.PROPERTIES.items():
+            if properties:
+                Build.TYPES[name] = BuildType(len(cls.kinds), name, properties)
+                cls.kinds.append(Build.TYPES[name])
+        for kind in cls.kinds:
+            cls.names.append(kind.name)
+            cls.ids[kind.name] = kind.id
+            cls.price.append(kind.price)
+            cls.attack.append(kind.attack)
+            cls.min_range.append(kind.attack_range[0])
+            cls.max_range.append(kind.attack_range[1])
+            cls.weapon_type.append(kind.weapon_type)
+            cls.armor_type.append(kind.armor_type)
+            cls.move_type.append(kind.move_type)
+            cls.movement.append(kind.movement)
+            cls.max_health.append(kind.max_health)
+            cls.income.append(kind.income if isinstance(kind, BuildType) else 0)
+            flags = (TypeFlag.ANTI_AIR if kind.anti_air else 0) | (TypeFlag.ANTI_SUB if kind.anti_sub else 0) | \
+                    (TypeFlag.BLITZ if kind.blitz else 0)
+            if isinstance(kind, BuildType):
+                flags |= TypeFlag.BUILD | (TypeFlag.STACKABLE if kind.stackable else 0) | \
+                         (TypeFlag.CAPTURABLE if kind.capturable else 0)
+            cls.flags.append(flags)
+        cls._compile_attack_tables()
+
+    @classmethod
+    def _compile_attack_tables(cls):
+        cls.type_count = len(cls.kinds)
+        cls.terrain_count = len(Terrain.PROPERTIES)
+        defences = [Terrain.PROPERTIES[terrain]['defence_factor'] for terrain in range(cls.terrain_count)]
+        for source in cls.kinds:
+            for target in cls.kinds:
+                # 与 GameManager 原先的逐项计算相同，保证浮点结果一致
+                weapon_diff = source.weapon_type - target.armor_type
+                if weapon_diff > 0:
+                    armor_factor = 1 + 0.0 * weapon_diff  # 强打弱增益系数
+                else:
+                    armor_factor = 1 + 0.15 * weapon_diff  # 弱打强衰减系数
+                cls.terrain_damage.extend((1 - defence) * armor_factor for defence in defences)
+                global_factor = 1.0 if source.attack_range[0] > 1 else 1.1  # 远程近程区别对待
+                can_attack = True
+                if not isinstance(target, BuildType):
+                    # 飞机打非空中的防空单位衰减伤害
+                    if source.move_type == MoveType.Air and target.move_type != MoveType.Air and target.anti_air:
+                        global_factor *= 0.8
+                    # 非海军单位打海军单位衰减伤害
+                    if source.move_type < 3 and target.move_type == MoveType.Sea:
+                        global_factor *= 0.8
+                    can_attack = not (target.move_type == MoveType.Air and not source.anti_air or
+                                      target.move_type == MoveType.Sub and not source.anti_sub)
+                cls.global_damage.append(global_factor)
+                cls.can_attack.append(can_attack)
+
+    @classmethod
+    def unit_ids(cls):
+        return range(cls.unit_count)
+
+TypeTable.compile()
+
 shop_available_units = {
-    SHOP_TYPE.GROUND: [unit for unit in Unit.PROPERTIES if Unit.PROPERTIES[unit]['move_type'] < 3],
-    SHOP_TYPE.AIR: [unit for unit in Unit.PROPERTIES if Unit.PROPERTIES[unit]['move_type'] == MoveType.Air],
-    SHOP_TYPE.SEA: [unit for unit in Unit.PROPERTIES if Unit.PROPERTIES[unit]['move_type'] == MoveType.Sea or
-                                                        Unit.PROPERTIES[unit]['move_type'] == MoveType.Sub],
+    SHOP_TYPE.GROUND: [TypeTable.names[i] for i in TypeTable.unit_ids() if TypeTable.move_type[i] < 3],
+    SHOP_TYPE.AIR: [TypeTable.names[i] for i in TypeTable.unit_ids() if TypeTable.move_type[i] == MoveType.Air],
+    SHOP_TYPE.SEA: [TypeTable.names[i] for i in TypeTable.unit_ids() if TypeTable.move_type[i] == MoveType.Sea or
+                                                                 TypeTable.move_type[i] == MoveType.Sub],
 }
\ No newline at end of file
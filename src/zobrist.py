@@ -0,0 +1,64 @@
+"""
+局面的 Zobrist 哈希
+- 每个对象的键由三部分异或而成，都按所在格区分：
+    - 棋子：类型 + 归属 + 格子
+    - 血量：精确值（浮点数的二进制表示）与格子的键混合，血量不同的局面哈希不同
+    - 状态位：moved / attacked / 建筑已叠加
+- 整个局面再异或上当前玩家和各玩家的精确金钱
+- 哈希相同即局面相同（除 64 位的偶然冲突外），评估和搜索结果可以按哈希复用；不要把参与评估的量分档后再哈希
+- 随机键由固定种子的独立随机数发生器生成，不影响游戏的 random，且在所有进程中相同
+- SearchState 增量维护哈希：修改对象前后各异或一次 object_key；换回合批量改状态位时直接替换 flags 表中的那一部分
+"""
+from units import TypeTable
+from array import array
+import random
+import struct
+
+SEED = 0x5A0B215
+FLAG_STATES = 8  # MOVED | ATTACKED | STACKED 的组合
+MASK = (1 << 64) - 1
+DOUBLE = struct.Struct('<d')
+UINT64 = struct.Struct('<Q')
+
+
+def mix(key, value):
+    """把 64 位整数 value 混入随机键 key（splitmix64 的终结函数），不同的 value 得到互不相关的键"""
+    value = (key + value) & MASK
+    value = (value ^ (value >> 30)) * 0xBF58476D1CE4E5B9 & MASK
+    value = (value ^ (value >> 27)) * 0x94D049BB133111EB & MASK
+    return value ^ (value >> 31)
+
+
+class ZobristTable:
+    _cache = {}  # 格子数 -> ZobristTable
+
+    def __init__(self, tile_count, seed=SEED):
+        rng = random.Random(seed)
+        keys = lambda count: array('Q', (rng.getrandbits(64) for _ in range(count)))
+        self.tile_count = tile_count
+        self.piece = keys(len(TypeTable.kinds) * 3 * tile_count)  # [类型][归属][格子]
+        self.health = keys(2 * tile_count)                         # [单位/建筑][格子]，与血量混合
+        self.flags = keys(2 * tile_count * FLAG_STATES)            # [单位/建筑][格子][状态位]
+        self.side = keys(2)
+        self.money = keys(3)                                       # [归属]，与金钱混合
+
+    @classmethod
+    def for_size(cls, tile_count):
+        """同样大小的地图共用一张表"""
+        table = cls._cache.get(tile_count)
+        if table is None:
+            table = cls._cache[tile_count] = cls(tile_count)
+        return table
+
+    def object_key(self, type_id, player_id, tile, health, flags):
+        tile_count = self.tile_count
+        layer = (type_id >= TypeTable.unit_count) * tile_count + tile
+        return self.piece[(type_id * 3 + player_id % 3) * tile_count + tile] ^ \
+               mix(self.health[layer], UINT64.unpack(DOUBLE.pack(health + 0.0))[0]) ^ \
+               self.flags[layer * FLAG_STATES + (flags & 7)]
+
+    def money_key(self, player_id, money):
+        return mix(self.money[player_id % 3], money & MASK)
+
+    def side_key(self, player_id):
+        return self.side[player_id]
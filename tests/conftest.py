@@ -0,0 +1,7 @@
+"""测试运行在 src/ 的模块上，地图等资源按仓库根目录的相对路径读取"""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'src'))
+os.chdir(ROOT)
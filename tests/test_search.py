@@ -0,0 +1,79 @@
+import random
+from game import GameManager
+from search import SearchState, DEAD
+from actions import ACTION_ATTACK, KIND_MASK
+from ai_worker import execute_action
+
+
+def test_incremental_evaluation_is_exact_after_long_execute_undo_sequences():
+    """增量维护的 evaluate 在任意执行 / 撤销序列之后都与从头计算逐位相同"""
+    for level in (1, 2, 3):
+        state = SearchState.from_game(GameManager(level))
+        rng = random.Random(level)
+        marks = []
+        for _ in range(5000):
+            roll = rng.random()
+            if roll < 0.15 and marks:
+                state.undo(marks.pop())
+            elif roll < 0.25:
+                marks.append(state.begin_undo())
+                state.next_turn()
+            else:
+                units = state.units_of(state.cur_player_id)
+                actions = state.actions(rng.choice(units)) if units else []
+                if not actions:
+                    continue
+                marks.append(state.begin_undo())
+                state.execute(rng.choice(actions))
+            for player_id, enemy_id in ((0, 1), (1, 0)):
+                assert state.evaluate(player_id, enemy_id) == state.compute_evaluation(player_id, enemy_id)
+        while marks:
+            state.undo(marks.pop())
+            assert state.evaluate(0, 1) == state.compute_evaluation(0, 1)
+
+
+def test_compact_maps_indices_to_the_worker_state():
+    """工作进程从快照恢复的局面不含阵亡的对象，compact 后的编号指向同一个格子上的同一个对象"""
+    state = SearchState.from_game(GameManager(1, seed=3))
+    rng = random.Random(0)
+    while not any(flags & DEAD for flags in state.flags):
+        moves = [action for index in state.units_of(state.cur_player_id) for action in state.actions(index)]
+        attacks = [action for action in moves if action & KIND_MASK == ACTION_ATTACK]
+        if attacks:
+            state.execute(rng.choice(attacks))
+        elif moves and rng.random() < 0.7:
+            state.execute(rng.choice(moves))
+        else:
+            state.next_turn()
+    alive = [index for index in range(len(state.kind)) if not state.flags[index] & DEAD]
+    compact, indices = state.compact(alive)
+    worker = SearchState.from_snapshot(state.to_snapshot(), state.map)
+    assert compact.hash == worker.hash == state.hash
+    for old, new in zip(alive, indices):
+        assert (worker.kind[new], worker.owner[new], worker.tile[new]) == \
+               (state.kind[old], state.owner[old], state.tile[old])
+    assert any(old != new for old, new in zip(alive, indices))
+
+
+def test_random_luck_follows_the_game_rng():
+    """luck 为 None 时，from_game 的局面与 GameManager 抽到同样的幸运值，执行同样的行动后局面相同"""
+    gm = GameManager(1, seed=5)
+    rng = random.Random(1)
+    attacks = 0
+    for _ in range(300):
+        state = SearchState.from_game(gm)
+        state.luck = None
+        moves = [action for index in state.units_of(state.cur_player_id) for action in state.actions(index)]
+        if not moves:
+            gm.next_turn()
+            continue
+        action = rng.choice([action for action in moves if action & KIND_MASK == ACTION_ATTACK] or moves)
+        state.execute(action)
+        execute_action(action, gm, True)
+        assert SearchState.from_game(gm).hash == state.hash
+        attacks += action & KIND_MASK == ACTION_ATTACK
+        if rng.random() < 0.2:
+            gm.next_turn()
+        if gm.check_game_over():
+            break
+    assert attacks > 0
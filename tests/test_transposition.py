@@ -0,0 +1,25 @@
+from game import GameManager
+from search import SearchState
+from transposition import TranspositionTable
+
+INF = float('inf')
+
+
+def test_probe_misses_positions_with_a_different_evaluation():
+    """只差一点血量或金钱的局面评估不同，不能命中对方的结果（表在单位、回合之间保留）"""
+    table = TranspositionTable()
+    state = SearchState.from_game(GameManager(1))
+    table.store(state.hash, 3, state.evaluate(0, 1), -INF, INF, 0)
+    assert table.probe(state.hash, 3, -INF, INF) == (None, state.evaluate(0, 1))
+
+    index = state.units_of(1)[0]
+    health = state.health[index]
+    state.health[index] = health - 0.01
+    state.hash = state.compute_hash()
+    table.new_search()
+    assert table.probe(state.hash, 1, -INF, INF) is None
+
+    state.health[index] = health
+    state.money[1] += 1
+    state.hash = state.compute_hash()
+    assert table.probe(state.hash, 1, -INF, INF) is None
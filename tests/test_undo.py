@@ -0,0 +1,45 @@
+import copy
+import random
+from game import GameManager
+from search import SearchState
+
+SHARED = ('map', 'zobrist', 'log', 'rng')  # 只读的共享数据、撤销日志本身和随机数发生器（不属于局面）
+
+
+def board(state):
+    return {name: value for name, value in vars(state).items() if name not in SHARED}
+
+
+def deepcopy(state):
+    """深拷贝局面，SHARED 中的属性不复制"""
+    return copy.deepcopy(state, {id(getattr(state, name)): getattr(state, name) for name in SHARED})
+
+
+def test_undo_restores_the_deepcopy_of_every_mark():
+    """随机执行 / 换回合 / 撤销（含嵌套标记），每次撤销后与打标记时的深拷贝完全相同"""
+    for level in (1, 2, 3):
+        state = SearchState.from_game(GameManager(level))
+        rng = random.Random(level)
+        marks = []  # [(标记, 打标记时的深拷贝)]
+        for _ in range(1500):
+            roll = rng.random()
+            if roll < 0.2 and marks:
+                mark, expected = marks.pop()
+                state.undo(mark)
+                assert len(state.log) == mark
+                assert board(state) == board(expected)
+                continue
+            snapshot = deepcopy(state)
+            if roll < 0.3:
+                marks.append((state.begin_undo(), snapshot))
+                state.next_turn()
+                continue
+            units = state.units_of(state.cur_player_id)
+            actions = state.actions(rng.choice(units)) if units else []
+            if actions:
+                marks.append((state.begin_undo(), snapshot))
+                state.execute(rng.choice(actions))
+        while marks:
+            mark, expected = marks.pop()
+            state.undo(mark)
+            assert board(state) == board(expected)
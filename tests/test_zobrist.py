@@ -0,0 +1,61 @@
+import random
+from game import GameManager
+from search import SearchState, DEAD
+
+
+def random_positions(level, steps, seed):
+    """在 SearchState 上随机执行 / 撤销行动，逐个产生经过的局面"""
+    state = SearchState.from_game(GameManager(level))
+    rng = random.Random(seed)
+    marks = []
+    for _ in range(steps):
+        roll = rng.random()
+        if roll < 0.1 and marks:
+            state.undo(marks.pop())
+        elif roll < 0.2:
+            marks.append(state.begin_undo())
+            state.next_turn()
+        else:
+            units = state.units_of(state.cur_player_id)
+            actions = state.actions(rng.choice(units)) if units else []
+            if not actions:
+                continue
+            marks.append(state.begin_undo())
+            state.execute(rng.choice(actions))
+        yield state
+
+
+def test_hash_is_incremental():
+    for state in random_positions(1, 500, 1):
+        assert state.hash == state.compute_hash()
+
+
+def test_equal_hash_means_equal_evaluation():
+    seen = {}
+    for level in (1, 2, 3):
+        for state in random_positions(level, 1500, level):
+            score = state.compute_evaluation(0, 1)
+            assert seen.setdefault((level, state.hash), score) == score
+
+
+def test_small_health_and_money_changes_change_the_hash():
+    gm = GameManager(1)
+    state = SearchState.from_game(gm)
+    index = state.units_of(0)[0]
+    base_hash, base_score = state.hash, state.evaluate(0, 1)
+
+    state.health[index] -= 0.01  # 与原血量在同一个十分位
+    state.hash = state.compute_hash()
+    assert state.compute_evaluation(0, 1) != base_score
+    assert state.hash != base_hash
+
+    state = SearchState.from_game(gm)
+    state.money[0] += 1  # 与原金钱在同一个 10 元档
+    state.hash = state.compute_hash()
+    assert state.compute_evaluation(0, 1) != base_score
+    assert state.hash != base_hash
+
+    unit = gm.players[0].units[0]
+    unit.health -= 0.01
+    assert gm.position_hash() != base_hash
+    assert gm.position_hash() == SearchState.from_game(gm).hash